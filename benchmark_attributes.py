@@ -0,0 +1,72 @@
+"""Times the RAD-TTS F0 and energy predictors with and without running them in
+two threads (`TTSEngine(concurrent_attributes=True)`).
+
+    python benchmark_attributes.py --model-dir ./models/ --threads 8 4
+"""
+
+import argparse
+import os
+import statistics
+
+import torch
+
+from tts_uk.inference import TTSEngine
+
+text = "Ні, дякую, не треба нічого, я вже поїв сьогодні вранці. " * 4
+
+
+def time_attributes(engine, tokens, n_runs):
+    speaker_id = engine.speaker_tensor("lada")
+    times, mel = [], None
+    with torch.inference_mode():
+        for _ in range(n_runs):
+            timer = engine.make_timer()
+            outputs = engine.radtts.infer(
+                speaker_id,
+                tokens,
+                0.8,
+                generator=torch.Generator().manual_seed(0),
+                timer=timer,
+            )
+            times.append(timer.stages["f0_energy"])
+            mel = outputs["mel"]
+    return statistics.median(times), mel
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=[os.cpu_count()],
+        help="intra-op thread counts to try",
+    )
+    parser.add_argument("--runs", type=int, default=9)
+    args = parser.parse_args()
+
+    engine = TTSEngine(device="cpu", model_dir=args.model_dir, profile=True).load()
+    tokens, _ = engine.encode_texts([text])
+
+    print(f"{os.cpu_count()} cores")
+    for n_threads in args.threads:
+        torch.set_num_threads(n_threads)
+        results = {}
+        for concurrent in (False, True):
+            engine.radtts.concurrent_attributes = concurrent
+            time_attributes(engine, tokens, 2)
+            results[concurrent] = time_attributes(engine, tokens, args.runs)
+        (serial, serial_mel), (concurrent, concurrent_mel) = (
+            results[False],
+            results[True],
+        )
+        diff = (serial_mel - concurrent_mel).abs().max().item()
+        print(
+            f"{n_threads} threads: f0_energy serial {serial * 1000:.1f} ms, "
+            f"concurrent {concurrent * 1000:.1f} ms, mel max diff {diff:.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
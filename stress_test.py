@@ -0,0 +1,70 @@
+"""Checks that one engine shared by concurrent threads gives the same audio as
+when its calls run one after another.
+
+    python stress_test.py --model-dir ./models/ --threads 8 --rounds 3
+"""
+
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from tts_uk.inference import TTSEngine
+
+texts = [
+    "Так.",
+    "Привіт, як справи?",
+    "Ні, дякую, не треба нічого.",
+    "Добрий день, шановні слухачі! Сьогодні гарна погода.",
+]
+
+voices = ["lada", "mykyta", "tetiana"]
+
+
+def make_jobs(n_jobs):
+    """Batches of one or two texts of different lengths, with distinct voices
+    and seeds"""
+    return [
+        (
+            [texts[i % len(texts)], texts[(i + 1) % len(texts)]][: 1 + i % 2],
+            voices[i % len(voices)],
+            i,
+        )
+        for i in range(n_jobs)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--jobs", type=int, default=12)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = TTSEngine(device=args.device, model_dir=args.model_dir).load()
+
+    def run(job):
+        batch_texts, voice, seed = job
+        mels, waves, _ = engine.synthesize_batch(batch_texts, voice, seed=seed)
+        return mels + waves
+
+    jobs = make_jobs(args.jobs)
+    serial = [run(job) for job in jobs]
+
+    n_mismatches = 0
+    for _ in range(args.rounds):
+        with ThreadPoolExecutor(args.threads) as executor:
+            concurrent = list(executor.map(run, jobs))
+        for expected, outputs in zip(serial, concurrent):
+            if not all(a.equal(b) for a, b in zip(expected, outputs)):
+                n_mismatches += 1
+
+    n_runs = args.rounds * len(jobs)
+    print(f"{n_mismatches} of {n_runs} concurrent results differ from serial ones")
+    if n_mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
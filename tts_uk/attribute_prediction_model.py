@@ -21,6 +21,7 @@
 
 import torch
 from torch import nn
+from torch.nn import functional as F
 
 from .autoregressive_flow import AR_Back_Step, AR_Step
 from .common import (
@@ -101,6 +102,43 @@ class BottleneckLayerLayer(nn.Module):
         return x
 
 
+def infer_bottlenecks(bottleneck_layers, x):
+    """Applies several BottleneckLayerLayers to the same input, as one conv
+    with their output channels stacked when their convs have the same shape.
+
+    Returns:
+        list with the output of every layer
+    """
+    convs = [layer.projection_fn for layer in bottleneck_layers]
+    fusable = (
+        all(layer.reduction_factor > 1 for layer in bottleneck_layers)
+        and all(isinstance(conv, ConvNorm) for conv in convs)
+        and not any(conv.use_partial_padding for conv in convs)
+        and len({type(layer.non_linearity) for layer in bottleneck_layers}) == 1
+        and len(
+            {
+                (c.conv.kernel_size, c.conv.stride, c.conv.padding, c.conv.dilation)
+                for c in convs
+            }
+        )
+        == 1
+    )
+    if not fusable:
+        return [layer(x) for layer in bottleneck_layers]
+
+    conv = convs[0].conv
+    x = F.conv1d(
+        x,
+        torch.cat([c.conv.weight for c in convs]),
+        torch.cat([c.conv.bias for c in convs]),
+        stride=conv.stride,
+        padding=conv.padding,
+        dilation=conv.dilation,
+    )
+    x = bottleneck_layers[0].non_linearity(x)
+    return list(x.split([c.conv.out_channels for c in convs], 1))
+
+
 class DAP(nn.Module):
     def __init__(
         self,
@@ -138,6 +176,15 @@ class DAP(nn.Module):
         x_hat = self.attribute_processing.denormalize(x_hat)
         return x_hat
 
+    def infer_bottlenecked(self, txt_enc, spk_emb, lens=None):
+        """Same as `infer` for a `txt_enc` that already went through the
+        bottleneck layer, see `infer_bottlenecks`
+        """
+        spk_emb_expanded = spk_emb[..., None].expand(-1, -1, txt_enc.shape[2])
+        context = torch.cat((txt_enc, spk_emb_expanded), 1)
+        x_hat = self.feat_pred_fn(context, lens)
+        return self.attribute_processing.denormalize(x_hat)
+
 
 class BGAP(torch.nn.Module):
     def __init__(
@@ -51,12 +51,9 @@ ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-import librosa.util as librosa_util
 import numpy as np
 import torch
 import torch.nn.functional as F
-from librosa.util import pad_center, tiny
-from scipy.signal import get_window
 from torch.autograd import Variable
 
 
@@ -101,6 +98,9 @@ def window_sumsquare(
     wss : np.ndarray, shape=`(n_fft + hop_length * (n_frames - 1))`
         The sum-squared envelope of the window function
     """
+    import librosa.util as librosa_util
+    from scipy.signal import get_window
+
     if win_length is None:
         win_length = n_fft
 
@@ -183,6 +183,9 @@ class STFT(torch.nn.Module):
 
         if window is not None:
             assert win_length >= filter_length
+            from librosa.util import pad_center
+            from scipy.signal import get_window
+
             # get window and zero center pad it to filter_length
             fft_window = get_window(window, win_length, fftbins=True)
             fft_window = pad_center(fft_window, size=filter_length)
@@ -248,6 +251,8 @@ class STFT(torch.nn.Module):
                 dtype=np.float32,
             )
             # remove modulation effects
+            from librosa.util import tiny
+
             approx_nonzero_indices = torch.from_numpy(
                 np.where(window_sum > tiny(window_sum))[0]
             )
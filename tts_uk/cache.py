@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import torch
+
+from .prosody import Prosody
+
+
+def make_cache_key(**fields):
+    """Hashes keyword fields (text, voice, parameters, seed) into a hex key"""
+    payload = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TensorCache:
+    """Content-addressed store of dictionaries of tensors.
+
+    Entries are kept in an in-memory LRU bounded by `max_bytes` and, when
+    `cache_dir` is given, also written to disk, so they outlive the process
+    and can be shared between workers. Entries are stored on the CPU.
+
+    Args:
+        max_bytes (int): Memory budget of the in-memory tier.
+        cache_dir (str, optional): Directory of the on-disk tier.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._n_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _entry_size(entry):
+        tensors = []
+        for value in entry.values():
+            tensors.extend(value if isinstance(value, list) else [value])
+        return sum(t.numel() * t.element_size() for t in tensors if t is not None)
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.pt"
+
+    def _remember(self, key, entry):
+        size = self._entry_size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._n_bytes -= self._entry_size(self._entries.pop(key))
+            self._entries[key] = entry
+            self._n_bytes += size
+            while self._n_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._n_bytes -= self._entry_size(evicted)
+
+    def get_entry(self, key):
+        """Returns the cached entry of a key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None and self.cache_dir is not None:
+            path = self._path(key)
+            if path.exists():
+                entry = torch.load(path, weights_only=True, map_location="cpu")
+                self._remember(key, entry)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry
+
+    def put_entry(self, key, entry):
+        """Stores a dictionary of CPU tensors, or lists of them, under a key"""
+        self._remember(key, entry)
+
+        if self.cache_dir is not None:
+            # write to a temporary file first, so readers never see partial files
+            path = self._path(key)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            torch.save(entry, tmp_path)
+            os.replace(tmp_path, path)
+
+    def clear(self):
+        """Drops the in-memory tier; the on-disk tier is left untouched"""
+        with self._lock:
+            self._entries.clear()
+            self._n_bytes = 0
+
+
+class SynthesisCache(TensorCache):
+    """Content-addressed store of synthesized mels and waveforms, see
+    `TensorCache`"""
+
+    def get(self, key):
+        """Returns the cached (mels, wave) of a key, or None"""
+        entry = self.get_entry(key)
+        if entry is None:
+            return None
+        return entry["mels"], entry["wave"]
+
+    def put(self, key, mels, wave):
+        """Stores a list of mels and their waveform under a key"""
+        entry = {
+            "mels": [mel.detach().cpu() for mel in mels],
+            "wave": wave.detach().cpu(),
+        }
+        self.put_entry(key, entry)
+
+
+class ProsodyCache(TensorCache):
+    """Content-addressed store of the `Prosody` of synthesis calls, see
+    `TensorCache`"""
+
+    def __init__(self, max_bytes=64 * 2**20, cache_dir=None):
+        super().__init__(max_bytes, cache_dir)
+
+    def get(self, key):
+        """Returns the cached `Prosody` of a key, or None"""
+        entry = self.get_entry(key)
+        if entry is None:
+            return None
+        return Prosody.from_dict(entry)
+
+    def put(self, key, prosody):
+        """Stores a `Prosody` under a key"""
+        self.put_entry(key, prosody.to_dict())
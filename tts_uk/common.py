@@ -55,6 +55,7 @@ import numpy as np
 import torch
 from torch import nn
 from torch.nn import functional as F
+from torch.nn.utils import parametrize
 
 from .partialconv1d import PartialConv1d as pconv1d
 from .splines import (
@@ -65,24 +66,136 @@ from .splines import (
 from .torch_env import device
 
 
-def get_mask_from_lengths(lengths):
+def get_mask_from_lengths(lengths, max_len=None):
     """Constructs binary mask from a 1D torch tensor of input lengths
 
     Args:
         lengths (torch.tensor): 1D tensor
+        max_len (int, optional): mask length, defaults to the longest length
     Returns:
         mask (torch.tensor): num_sequences x max_length x 1 binary tensor
     """
 
-    max_len = torch.max(lengths).item()
+    if max_len is None:
+        max_len = torch.max(lengths).item()
 
-    ids = torch.tensor(list(range(max_len)), dtype=torch.long, device=device)
+    ids = torch.arange(max_len, dtype=torch.long, device=lengths.device)
 
     mask = (ids < lengths.unsqueeze(1)).bool()
 
     return mask
 
 
+class MaskContext:
+    """Mask of the valid frames of a batch, built once and shared by every
+    layer run over the batch (e.g. all the flow steps of the decoder).
+
+    The update masks and mask ratios of partial convs are cached per conv
+    geometry. Without padding the masks are all ones, so multiplying by them
+    is skipped; only the rescaling at the sequence edges remains.
+
+    Args:
+        seq_lens (torch.tensor): B sequence lengths
+        max_len (int, optional): padded length, defaults to the longest length
+    """
+
+    def __init__(self, seq_lens, max_len=None):
+        if max_len is None:
+            max_len = int(seq_lens.max())
+        self.seq_lens = seq_lens
+        self.max_len = max_len
+        self.mask = get_mask_from_lengths(seq_lens, max_len).unsqueeze(1).float()
+        self.is_full = bool((seq_lens == max_len).all())
+
+        self._mask_ratios = {}
+        self._windows = {}
+
+    @classmethod
+    def wrap(cls, seq_lens, max_len):
+        """Returns a context for `seq_lens`, which may already be one, or None"""
+        if seq_lens is None or isinstance(seq_lens, cls):
+            return seq_lens
+        return cls(seq_lens, max_len)
+
+    @property
+    def padding_mask(self):
+        """B x 1 x T mask to zero the padding with, None without padding"""
+        return None if self.is_full else self.mask
+
+    def get_mask_ratios(self, conv):
+        """Returns the (update_mask, mask_ratio) of a PartialConv1d"""
+        key = (conv.kernel_size, conv.dilation, conv.padding, conv.stride)
+        if key not in self._mask_ratios:
+            update_mask, mask_ratio = conv.get_mask_ratios(self.mask)
+            if self.is_full:
+                update_mask = None
+            self._mask_ratios[key] = (update_mask, mask_ratio)
+        return self._mask_ratios[key]
+
+    def window(self, start, end):
+        """Returns the context of frames start:end, cached for all callers"""
+        if (start, end) not in self._windows:
+            seq_lens = (self.seq_lens - start).clamp(0, end - start)
+            self._windows[start, end] = MaskContext(seq_lens, end - start)
+        return self._windows[start, end]
+
+
+def masked_instance_norm(x, mask, norm):
+    """Applies an InstanceNorm1d to a zero-padded batch, with the statistics
+    of every item taken over its valid frames only
+
+    Args:
+        x (torch.tensor): B x C x T input
+        mask (torch.tensor): B x 1 x T mask of the valid frames
+        norm (nn.InstanceNorm1d): norm to take eps and the affine parameters of
+    """
+    n_frames = mask.sum(2, keepdim=True)
+    mean = (x * mask).sum(2, keepdim=True) / n_frames
+    var = ((x - mean) * mask).pow(2).sum(2, keepdim=True) / n_frames
+    x = (x - mean) * torch.rsqrt(var + norm.eps)
+    if norm.affine:
+        x = x * norm.weight[:, None] + norm.bias[:, None]
+    return x * mask
+
+
+def remove_parametrizations(model):
+    """Bakes every parametrization of `model` (weight_norm, spectral_norm) into
+    a plain parameter holding its current value. Returns the names of the
+    parametrized tensors.
+
+    Parametrizations are evaluated in the mode the model is in; call `eval()`
+    first, so that spectral norms do not take one more power iteration step.
+    """
+    removed = []
+    # not under no_grad: a baked tensor that does not require grad would be
+    # registered as a buffer instead of a parameter
+    for module_name, module in model.named_modules():
+        if not parametrize.is_parametrized(module):
+            continue
+        for name in list(module.parametrizations.keys()):
+            parametrize.remove_parametrizations(module, name, leave_parametrized=True)
+            removed.append("{}.{}".format(module_name, name))
+    return removed
+
+
+def invert_weight(W, rtol=1e-4):
+    """Inverts a square weight in float32, checked against a float64 inverse
+
+    Raises:
+        ValueError: if the float32 inverse is off by more than `rtol`
+    """
+    W_inverse = torch.linalg.inv(W.float())
+    if not W.is_meta:
+        reference = torch.linalg.inv(W.double())
+        error = (W_inverse.double() - reference).abs().max()
+        if error > rtol * reference.abs().max():
+            raise ValueError(
+                "Inverse of the 1x1 conv weight is inaccurate "
+                "(max error {:.2e})".format(error.item())
+            )
+    return W_inverse
+
+
 class ExponentialClass(torch.nn.Module):
     def __init__(self):
         super(ExponentialClass, self).__init__()
@@ -145,8 +258,15 @@ class ConvNorm(torch.nn.Module):
             self.conv = torch.nn.utils.parametrizations.weight_norm(self.conv)
 
     def forward(self, signal, mask=None):
+        # mask is either a B x 1 x T tensor or a MaskContext
+        masks = None
+        if isinstance(mask, MaskContext):
+            masks, mask = mask, mask.padding_mask
         if self.use_partial_padding:
-            conv_signal = self.conv(signal, mask)
+            mask_ratios = None
+            if masks is not None:
+                mask_ratios = masks.get_mask_ratios(self.conv)
+            conv_signal = self.conv(signal, mask, mask_ratios)
         else:
             conv_signal = self.conv(signal)
         if mask is not None:
@@ -174,34 +294,44 @@ class DenseLayer(nn.Module):
 
 
 class LengthRegulator(nn.Module):
+    """Repeats every token of a B x N x C batch for its duration in frames.
+
+    All items are expanded with a single `repeat_interleave`: a zero token is
+    appended to every item and repeated to pad it to the longest one.
+    """
+
     def __init__(self):
         super().__init__()
 
-    def forward(self, x, dur):
-        output = []
-        for x_i, dur_i in zip(x, dur):
-            expanded = self.expand(x_i, dur_i)
-            output.append(expanded)
-        output = self.pad(output)
-        return output
-
-    def expand(self, x, dur):
-        output = []
-        for i, frame in enumerate(x):
-            expanded_len = int(dur[i] + 0.5)
-            expanded = frame.expand(expanded_len, -1)
-            output.append(expanded)
-        output = torch.cat(output, 0)
-        return output
+    def forward(self, x, dur, return_index=False):
+        """
+        Args:
+            x: B x N x C token features
+            dur: B x N token durations, rounded to the nearest integer
+            return_index (bool): Also return the B frame lengths and the B x T
+                index of the token every frame comes from (-1 on padding).
 
-    def pad(self, x):
-        output = []
-        max_len = max([x[i].size(0) for i in range(len(x))])
-        for i, seq in enumerate(x):
-            padded = F.pad(seq, [0, 0, 0, max_len - seq.size(0)], "constant", 0.0)
-            output.append(padded)
-        output = torch.stack(output)
-        return output
+        Returns:
+            B x T x C frame features, with T the longest total duration
+        """
+        batch_size, n_tokens, n_channels = x.shape
+        dur = (dur + 0.5).long()
+        lens = dur.sum(1)
+        max_len = int(lens.max())
+
+        repeats = torch.cat([dur, (max_len - lens).unsqueeze(1)], 1).flatten()
+        x = F.pad(x, [0, 0, 0, 1]).reshape(-1, n_channels)
+        output = x.repeat_interleave(repeats, 0, output_size=batch_size * max_len)
+        output = output.view(batch_size, max_len, n_channels)
+        if not return_index:
+            return output
+
+        index = torch.arange(n_tokens + 1, device=dur.device)
+        index[-1] = -1
+        index = index.repeat(batch_size).repeat_interleave(
+            repeats, output_size=batch_size * max_len
+        )
+        return output, lens, index.view(batch_size, max_len)
 
 
 class ConvLSTMLinear(nn.Module):
@@ -262,14 +392,15 @@ class ConvLSTMLinear(nn.Module):
             self.dense = nn.Linear(n_channels, out_dim)
 
     def run_padded_sequence(self, context, lens):
-        context_embedded = []
-        for b_ind in range(context.size()[0]):  # TODO: speed up
-            curr_context = context[b_ind : b_ind + 1, :, : lens[b_ind]].clone()
-            for conv in self.convolutions:
-                curr_context = self.dropout(F.relu(conv(curr_context)))
-            context_embedded.append(curr_context[0].transpose(0, 1))
-        context = torch.nn.utils.rnn.pad_sequence(context_embedded, batch_first=True)
-        return context
+        """Runs the conv stack over a zero-padded B x C x T batch at once.
+        Frames past the length of an item are zeroed before every conv, so
+        each item sees the same zero padding as when run on its own.
+        """
+        mask = get_mask_from_lengths(lens)[:, None].to(context.dtype)
+        context = context[:, :, : mask.shape[2]]
+        for conv in self.convolutions:
+            context = self.dropout(F.relu(conv(context * mask)))
+        return context * mask
 
     def run_unsorted_inputs(self, fn, context, lens):
         lens_sorted, ids_sorted = torch.sort(lens, descending=True)
@@ -292,8 +423,6 @@ class ConvLSTMLinear(nn.Module):
     def forward(self, context, lens):
         if context.size()[0] > 1:
             context = self.run_padded_sequence(context, lens)
-            # to B, D, T
-            context = context.transpose(1, 2)
         else:
             for conv in self.convolutions:
                 context = self.dropout(F.relu(conv(context)))
@@ -378,13 +507,18 @@ class Encoder(nn.Module):
             in_lens (torch.tensor): 1D tensor of sequence lengths
         """
         if x.size()[0] > 1:
-            x_embedded = []
-            for b_ind in range(x.size()[0]):  # TODO: improve speed
-                curr_x = x[b_ind : b_ind + 1, :, : in_lens[b_ind]].clone()
-                for conv in self.convolutions:
-                    curr_x = F.dropout(F.relu(conv(curr_x)), 0.5, self.training)
-                x_embedded.append(curr_x[0].transpose(0, 1))
-            x = torch.nn.utils.rnn.pad_sequence(x_embedded, batch_first=True)
+            # the partial convs and the norms only see the valid frames of
+            # every item, so the whole batch runs at once
+            mask = get_mask_from_lengths(in_lens)[:, None].to(x.dtype)
+            x = x[:, :, : mask.shape[2]]
+            for conv, norm in self.convolutions:
+                x = conv(x, mask)
+                if isinstance(norm, nn.InstanceNorm1d):
+                    x = masked_instance_norm(x, mask, norm)
+                else:
+                    x = norm(x) * mask
+                x = F.dropout(F.relu(x), 0.5, self.training)
+            x = x.transpose(1, 2)
         else:
             for conv in self.convolutions:
                 x = F.dropout(F.relu(conv(x)), 0.5, self.training)
@@ -393,7 +527,9 @@ class Encoder(nn.Module):
         # recent amp change -- change in_lens to int
         in_lens = in_lens.int().cpu()
 
-        x = nn.utils.rnn.pack_padded_sequence(x, in_lens, batch_first=True)
+        x = nn.utils.rnn.pack_padded_sequence(
+            x, in_lens, batch_first=True, enforce_sorted=False
+        )
 
         self.lstm.flatten_parameters()
         outputs, _ = self.lstm(x)
@@ -433,26 +569,42 @@ class Invertible1x1ConvLUS(torch.nn.Module):
         self.upper_diag = nn.Parameter(torch.diag(upper))
         self.upper = nn.Parameter(torch.triu(upper, 1))
         self.cache_inverse = cache_inverse
+        # computed by enable_inverse_cache once the weights are final, and
+        # saved with them from then on
+        self.register_buffer("W_inverse", None)
 
-    @torch.autocast(device, enabled=False)
-    def forward(self, z, inverse=False):
+    def get_weight(self):
         U = torch.triu(self.upper, 1) + torch.diag(self.upper_diag)
         L = torch.tril(self.lower, -1) + torch.diag(self.lower_diag)
-        W = torch.mm(self.p, torch.mm(L, U))
+        return torch.mm(self.p, torch.mm(L, U))
+
+    def enable_inverse_cache(self):
+        """Precomputes the weight of the inverse convolution. Call it once
+        the weights are loaded and the model is on its device.
+        """
+        self.cache_inverse = True
+        with torch.no_grad():
+            if any(t.is_meta for t in self.state_dict().values()):
+                # built on "meta" to load the weights into: only the shape of
+                # the inverse is needed, its value is loaded along
+                W_inverse = torch.empty_like(self.upper)
+            else:
+                W_inverse = invert_weight(self.get_weight())
+            self.W_inverse = W_inverse[..., None]
+
+    @torch.autocast(device, enabled=False)
+    def forward(self, z, inverse=False):
         if inverse:
-            if not hasattr(self, "W_inverse"):
+            W_inverse = self.W_inverse
+            if W_inverse is None:
                 # inverse computation
-                W_inverse = W.float().inverse()
-                if z.is_cuda and z.dtype == torch.float16:
-                    W_inverse = W_inverse.half()
-
-                self.W_inverse = W_inverse[..., None]
-            z = F.conv1d(z, self.W_inverse, bias=None, stride=1, padding=0)
-            if not self.cache_inverse:
-                delattr(self, "W_inverse")
+                W_inverse = self.get_weight().float().inverse()[..., None]
+            if z.is_cuda and z.dtype == torch.float16:
+                W_inverse = W_inverse.half()
+            z = F.conv1d(z, W_inverse, bias=None, stride=1, padding=0)
             return z
         else:
-            W = W[..., None]
+            W = self.get_weight()[..., None]
             z = F.conv1d(z, W, bias=None, stride=1, padding=0)
             log_det_W = torch.sum(torch.log(torch.abs(self.upper_diag)))
             return z, log_det_W
@@ -480,22 +632,30 @@ class Invertible1x1Conv(torch.nn.Module):
         W = W.view(c, c, 1)
         self.conv.weight.data = W
         self.cache_inverse = cache_inverse
+        # computed by enable_inverse_cache once the weights are final, and
+        # saved with them from then on
+        self.register_buffer("W_inverse", None)
+
+    def enable_inverse_cache(self):
+        """Precomputes the weight of the inverse convolution. Call it once
+        the weights are loaded and the model is on its device.
+        """
+        self.cache_inverse = True
+        with torch.no_grad():
+            self.W_inverse = invert_weight(self.conv.weight.squeeze())[..., None]
 
     def forward(self, z, inverse=False):
         # DO NOT apply n_of_groups, as it doesn't account for padded sequences
         W = self.conv.weight.squeeze()
 
         if inverse:
-            if not hasattr(self, "W_inverse"):
+            W_inverse = self.W_inverse
+            if W_inverse is None:
                 # Inverse computation
-                W_inverse = W.float().inverse()
-                if z.is_cuda and z.dtype == torch.float16:
-                    W_inverse = W_inverse.half()
-
-                self.W_inverse = W_inverse[..., None]
-            z = F.conv1d(z, self.W_inverse, bias=None, stride=1, padding=0)
-            if not self.cache_inverse:
-                delattr(self, "W_inverse")
+                W_inverse = W.float().inverse()[..., None]
+            if z.is_cuda and z.dtype == torch.float16:
+                W_inverse = W_inverse.half()
+            z = F.conv1d(z, W_inverse, bias=None, stride=1, padding=0)
             return z
         else:
             # Forward computation
@@ -523,9 +683,12 @@ class SimpleConvNet(torch.nn.Module):
         in_channels = n_mel_channels + n_context_dim
         out_channels = -1
         self.use_partial_padding = use_partial_padding
+        # frames on each side that an output frame depends on
+        self.receptive_field = 0
         for i in range(n_layers):
             dilation = 2**i if with_dilation else 1
             padding = int((kernel_size * dilation - dilation) / 2)
+            self.receptive_field += padding
             out_channels = min(max_channels, in_channels * 2)
             self.layers.append(
                 ConvNorm(
@@ -551,14 +714,12 @@ class SimpleConvNet(torch.nn.Module):
             self.last_layer.bias.data *= 0
 
     def forward(self, z_w_context, seq_lens: torch.Tensor = None):
-        # seq_lens: tensor array of sequence sequence lengths
+        # seq_lens: tensor array of sequence sequence lengths, or a MaskContext
         # output should be b x n_mel_channels x z_w_context.shape(2)
-        mask = None
-        if seq_lens is not None:
-            mask = get_mask_from_lengths(seq_lens).unsqueeze(1).float()
+        masks = MaskContext.wrap(seq_lens, z_w_context.shape[2])
 
         for i in range(self.n_layers):
-            z_w_context = self.layers[i](z_w_context, mask)
+            z_w_context = self.layers[i](z_w_context, masks)
             z_w_context = torch.relu(z_w_context)
 
         z_w_context = self.last_layer(z_w_context)
@@ -583,6 +744,7 @@ class WN(torch.nn.Module):
         super(WN, self).__init__()
         assert kernel_size % 2 == 1
         assert n_channels % 2 == 0
+        self.n_in_channels = n_in_channels
         self.n_layers = n_layers
         self.n_channels = n_channels
         self.in_layers = torch.nn.ModuleList()
@@ -600,9 +762,12 @@ class WN(torch.nn.Module):
         end.bias.data.zero_()
         self.end = end
 
+        # frames on each side that an output frame depends on
+        self.receptive_field = 0
         for i in range(n_layers):
             dilation = 2**i
             padding = int((kernel_size * dilation - dilation) / 2)
+            self.receptive_field += padding
             in_layer = ConvNorm(
                 n_channels,
                 n_channels,
@@ -624,20 +789,26 @@ class WN(torch.nn.Module):
         self,
         forward_input: Tuple[torch.Tensor, torch.Tensor],
         seq_lens: torch.Tensor = None,
+        context_proj: torch.Tensor = None,
     ):
+        # context_proj: the context columns of `start` applied to the context
+        # ahead of time (with the bias), in which case context is not used
         z, context = forward_input
-        z = torch.cat((z, context), 1)  # append context to z as well
-        z = self.start(z)
+        if context_proj is None:
+            z = torch.cat((z, context), 1)  # append context to z as well
+            z = self.start(z)
+        else:
+            z_weight = self.start.weight[:, : self.n_in_channels]
+            z = F.conv1d(z, z_weight) + context_proj
         output = torch.zeros_like(z)
-        mask = None
-        if seq_lens is not None:
-            mask = get_mask_from_lengths(seq_lens).unsqueeze(1).float()
+        # seq_lens: tensor array of sequence lengths, or a MaskContext
+        masks = MaskContext.wrap(seq_lens, z.shape[2])
         non_linearity = torch.relu
         if self.affine_activation == "softplus":
             non_linearity = self.softplus
 
         for i in range(self.n_layers):
-            z = non_linearity(self.in_layers[i](z, mask))
+            z = non_linearity(self.in_layers[i](z, masks))
             res_skip_acts = non_linearity(self.res_skip_layers[i](z))
             output = output + res_skip_acts
 
@@ -931,12 +1102,12 @@ class AffineTransformationLayer(torch.nn.Module):
             log_s = torch.cat(log_s_list, dim=1)
         return s, log_s
 
-    def forward(self, z, context, inverse=False, seq_lens=None):
+    def forward(self, z, context, inverse=False, seq_lens=None, context_proj=None):
         n_half = int(self.n_mel_channels / 2)
         z_0, z_1 = z[:, :n_half], z[:, n_half:]
         if self.affine_model == "wavenet":
             affine_params = self.affine_param_predictor(
-                (z_0, context), seq_lens=seq_lens
+                (z_0, context), seq_lens=seq_lens, context_proj=context_proj
             )
         elif self.affine_model == "simple_conv":
             z_w_context = torch.cat((z_0, context), 1)
@@ -60,6 +60,10 @@ _whitespace_re = re.compile(r"\s+")
 # Regular expression separating words enclosed in curly braces for cleaning
 _arpa_re = re.compile(r"{[^}]+}|\S+")
 
+# Regular expression matching the whitespace after sentence punctuation, so
+# that the dot of a number such as 3.5 does not end a sentence
+_sentence_re = re.compile(r"(?<=[.?!])\s+")
+
 
 def lowercase(text):
     return text.lower()
@@ -73,6 +77,13 @@ def remove_space_before_punctuation(text):
     return re.sub(r"\s([{}](?:\s|$))".format(punctuation), r"\1", text)
 
 
+def split_sentences(text):
+    """Splits text at whitespace after the sentence punctuation (.?!)"""
+    sentences = [s.strip() for s in _sentence_re.split(text.strip())]
+    sentences = [s for s in sentences if s]
+    return sentences or [text]
+
+
 class Cleaner:
     def __init__(self, cleaner_names, phonemedict):
         self.cleaner_names = cleaner_names
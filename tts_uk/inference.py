@@ -1,148 +1,799 @@
+import importlib
 import os
+import shutil
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
 from pathlib import Path
 
 import torch
-from huggingface_hub import hf_hub_download
 
-from .torch_env import device
-from .common import update_params
+from .cache import make_cache_key
 from .config import config
-from .data import TextProcessor
+from .data import TextProcessor, split_sentences
+from .model_files import (  # noqa: F401
+    FROZEN_FILES,
+    MODEL_FILES,
+    RADTTS_FILENAME,
+    RADTTS_REPO_ID,
+    VOCOS_REPO_ID,
+    download_file_from_repo,
+    model_fingerprint,
+    resolve_model_files,
+)
+from .profiling import StageTimer, count_macs, synchronize, time_stage
+from .prosody import Prosody
+from .torch_env import device as default_device
+
+voices = {
+    "lada": 0,
+    "mykyta": 1,
+    "tetiana": 2,
+}
+
+# tokens of this text are tiled into the synthetic inputs of `TTSEngine.warmup`
+warmup_text = "Привіт."
+
+# (n_tokens, n_frames) shapes run by `TTSEngine.warmup`, roughly a short
+# phrase, a sentence and a paragraph
+warmup_buckets = ((16, 128), (64, 512), (256, 2048))
+
+# parameters a variant of `TTSEngine.synthesize_fanout` may set, and defaults
+fanout_defaults = {
+    "token_dur_scaling": 1,
+    "f0_mean": 0,
+    "f0_std": 0,
+    "sigma_decoder": 0.8,
+    "sigma_token_duration": 0.666,
+    "sigma_f0": 1,
+    "sigma_energy": 1,
+}
+
+
+def median(values):
+    """Returns the median of a list of numbers, or None if it is empty"""
+    if not values:
+        return None
+    return sorted(values)[len(values) // 2]
 
-from vocos.pretrained import Vocos
-from .radtts import RADTTS
 
+def write_file(path, write):
+    """Calls `write` with a temporary path and moves the file into `path`.
 
-def download_file_from_repo(
-    repo_id: str,
-    filename: str,
-    local_dir: str = ".",
-    repo_type: str = "model",
-) -> str:
+    The old file is replaced at once instead of being overwritten, so that
+    processes reading or memory-mapping it never see a partial file.
+    """
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
     try:
-        os.makedirs(local_dir, exist_ok=True)
-
-        file_path = hf_hub_download(
-            repo_id=repo_id,
-            filename=filename,
-            local_dir=local_dir,
-            cache_dir=None,
-            force_download=False,
-            repo_type=repo_type,
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+class TTSEngine:
+    """RAD-TTS++ acoustic model and Vocos vocoder behind one synthesis API.
+
+    Constructing an engine is cheap: the checkpoints are resolved and the
+    models are built on the first synthesis call or on an explicit `load()`.
+    Every engine owns its models, device, text processor and voice table, so
+    several engines can live in one process (e.g. one per GPU).
+
+    Args:
+        device (str, optional): Device to run the models on. Defaults to the
+            device picked by `tts_uk.torch_env`.
+        local_dir (str): Directory the RAD-TTS checkpoint is downloaded to.
+        model_dir (str, optional): Local directory with the model files laid
+            out as in `tts_uk.model_files.MODEL_FILES`; the hub is not
+            contacted for the files found there.
+        model_paths (dict, optional): Explicit paths of some or all of the
+            "radtts", "vocos_config" and "vocos_model" files.
+        manifest (str, optional): JSON manifest with the sha256 of the model
+            files to verify them against. Defaults to `manifest.json` in
+            `model_dir`, if there is one.
+        flow_memory_budget (int, optional): Bytes the RAD-TTS flow decoder may
+            use for its activations; long inputs are then decoded in windows.
+        concurrent_attributes (bool): Run the RAD-TTS F0 and energy
+            predictors in two threads on CPU, see
+            `RADTTS.infer_f0_and_energy`.
+        cache (SynthesisCache, optional): Store of seeded `synthesis` results;
+            a repeated request is answered from it without running the models.
+            Results are keyed by the sha256 of the model files, which are
+            hashed at load time, and the device type.
+        prosody_cache (ProsodyCache, optional): Store of the prosody of seeded
+            calls; a request that differs only in `sigma_decoder` reuses it
+            and skips the duration and attribute predictors. Keyed like
+            `cache`, by the model files and the device type among others.
+        profile (bool): Add the time spent in every stage to the stats.
+        synchronize (bool): Synchronize the device around profiled stages, so
+            asynchronous CUDA work is charged to the stage that queued it.
+    """
+
+    sampling_rate = 44_100
+
+    def __init__(
+        self,
+        device=None,
+        local_dir="./models/",
+        model_dir=None,
+        model_paths=None,
+        manifest=None,
+        flow_memory_budget=None,
+        concurrent_attributes=False,
+        cache=None,
+        prosody_cache=None,
+        profile=False,
+        synchronize=False,
+    ):
+        self.device = device or default_device
+        self.local_dir = local_dir
+        self.model_dir = model_dir
+        self.model_paths = model_paths
+        self.manifest = manifest
+        self.flow_memory_budget = flow_memory_budget
+        self.concurrent_attributes = concurrent_attributes
+        self.cache = cache
+        self.prosody_cache = prosody_cache
+        self.profile = profile
+        self.synchronize = synchronize
+        self.voices = dict(voices)
+
+        self.radtts = None
+        self.vocos = None
+        self.model_files = None
+        self.text_processor = None
+
+        self.startup_report = {}
+        self.warmup_report = []
+        self.stage_macs = {}
+        self.model_fingerprint = None
+
+        self._load_lock = threading.RLock()
+
+    @property
+    def device_type(self):
+        return torch.device(self.device).type
+
+    @property
+    def is_loaded(self):
+        return self.radtts is not None
+
+    def load(self, warmup=False):
+        """Loads both models and the text processor, once.
+
+        With `warmup`, `warmup()` is run with the default buckets, so that the
+        one-off costs of the first calls are paid here. The time spent on each
+        startup step is kept in `startup_report`.
+        """
+        with self._load_lock:
+            if not self.is_loaded:
+                self._load()
+            if warmup and "warmup" not in self.startup_report:
+                start = time.perf_counter()
+                self.warmup()
+                self.startup_report["warmup"] = time.perf_counter() - start
+                self.startup_report["total"] += self.startup_report["warmup"]
+        return self
+
+    def warmup(self, buckets=warmup_buckets, voices=None, n_steady=3):
+        """Runs synthetic inputs through both models and discards the outputs.
+
+        Kernel selection, oneDNN primitives, LSTM weight packing and other
+        lazily created state are set up on the first call with a given shape;
+        warming up every bucket of expected input sizes keeps that cost out
+        of the first real requests.
+
+        Args:
+            buckets: (n_tokens, n_frames) shapes to run. The frame count is
+                forced by spreading it evenly over the tokens.
+            voices: Voices to run every bucket with. Defaults to all voices.
+            n_steady (int): Calls per voice after the first one, used to
+                measure the steady-state latency.
+
+        Returns:
+            list of dictionaries with the n_tokens and n_frames of every
+            bucket, its first_call latency in seconds (the first call with
+            its shape) and the steady_state (median) latency of the calls
+            after the first one of every voice; "voices" holds both
+            latencies per voice. The list is also kept in `warmup_report`
+        """
+        self.load()
+
+        voices = list(self.voices) if voices is None else list(voices)
+        text_tokens = self.text_processor.tp.encode_text(warmup_text)
+
+        report = []
+        for n_tokens, n_frames in buckets:
+            tokens = torch.LongTensor(text_tokens * (n_tokens // len(text_tokens) + 1))
+            tokens = tokens[None, :n_tokens].to(self.device)
+            dur = torch.full((1, n_tokens), n_frames // n_tokens, dtype=torch.int)
+            dur[:, : n_frames % n_tokens] += 1
+            dur = dur.to(self.device)
+
+            voice_latencies = {}
+            for voice in voices:
+                speaker_id = self.speaker_tensor(voice)
+                latencies = []
+                for _ in range(1 + n_steady):
+                    start = time.perf_counter()
+                    self._run_warmup_call(speaker_id, tokens, dur)
+                    synchronize(self.device)
+                    latencies.append(time.perf_counter() - start)
+                voice_latencies[voice] = latencies
+
+            # the first call of every voice is left out of the steady state
+            steady = [
+                t for latencies in voice_latencies.values() for t in latencies[1:]
+            ]
+            report.append(
+                {
+                    "n_tokens": n_tokens,
+                    "n_frames": n_frames,
+                    "first_call": voice_latencies[voices[0]][0],
+                    "steady_state": median(steady),
+                    "voices": {
+                        voice: {
+                            "first_call": latencies[0],
+                            "steady_state": median(latencies[1:]),
+                        }
+                        for voice, latencies in voice_latencies.items()
+                    },
+                }
+            )
+
+        self.warmup_report = report
+        return report
+
+    def _run_warmup_call(self, speaker_id, tokens, dur):
+        with torch.autocast(self.device_type, enabled=False):
+            with torch.inference_mode():
+                outputs = self.radtts.infer(
+                    speaker_id,
+                    tokens,
+                    0.8,
+                    dur=dur,
+                    flow_memory_budget=self.flow_memory_budget,
+                    generator=self.make_generator(0),
+                )
+                mels = self.trim_mels(outputs)
+        self.vocos.decode_batch(mels)
+
+    def _load(self):
+        load_start = time.perf_counter()
+        timer = StageTimer()
+
+        with timer.stage("import"):
+            # the model code pulls in numba, torchaudio, etc., so it is only
+            # imported once the models are needed
+            importlib.import_module("vocos.pretrained")
+            importlib.import_module(".radtts", __package__)
+
+        with timer.stage("resolve_files"):
+            paths = resolve_model_files(
+                self.model_dir, self.model_paths, self.local_dir, self.manifest
+            )
+
+        # cached results are only valid for the models that produced them
+        fingerprint = None
+        if self.cache is not None or self.prosody_cache is not None:
+            with timer.stage("fingerprint"):
+                fingerprint = model_fingerprint(paths)
+
+        # both models and the text processor are independent, load them at once
+        vocos_timer, radtts_timer = StageTimer(), StageTimer()
+        with timer.stage("load"):
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                vocos = executor.submit(self._load_vocos, paths, vocos_timer)
+                radtts = executor.submit(self._load_radtts, paths, radtts_timer)
+                text_processor = executor.submit(self._load_text_processor)
+                vocos, radtts = vocos.result(), radtts.result()
+                text_processor = text_processor.result()
+
+        radtts_params = f"{sum(param.numel() for param in radtts.parameters()):,}"
+        vocos_params = f"{sum(param.numel() for param in vocos.parameters()):,}"
+
+        print(f"Loaded checkpoint (RAD-TTS++), number of parameters: {radtts_params}")
+        print(f"Loaded checkpoint (Vocos), number of parameters: {vocos_params}")
+
+        self.startup_report = {
+            **timer.stages,
+            "radtts": radtts_timer.stages,
+            "vocos": vocos_timer.stages,
+            "total": time.perf_counter() - load_start,
+        }
+        print(f"Models loaded in {self.startup_report['total']:.2f}s")
+
+        self.stage_macs = {
+            **radtts.stage_macs(),
+            "vocoder": (0, count_macs([vocos.backbone, vocos.head])),
+        }
+        self.text_processor = text_processor
+        self.model_files = paths
+        self.model_fingerprint = fingerprint
+        self.vocos = vocos
+        self.radtts = radtts
+
+    def _load_text_processor(self):
+        data_config = config["data_config"]
+        return TextProcessor(
+            data_config["training_files"],
+            **dict(
+                (k, v)
+                for k, v in data_config.items()
+                if k not in ["training_files", "validation_files"]
+            ),
         )
 
-        return file_path
-    except Exception as e:
-        raise Exception(f"An error occurred during download: {e}") from e
+    def _load_vocos(self, paths, timer):
+        from vocos.pretrained import Vocos
 
+        with timer.stage("construct"):
+            vocos = Vocos.from_hparams(paths["vocos_config"])
 
-download_file_from_repo(
-    "Yehor/radtts-uk",
-    "radtts-pp-dap-model/model_dap_84000_state.pt",
-    "./models/",
-)
+        if "vocos_frozen" in paths:
+            # frozen weights are mapped rather than read, so processes share them
+            with timer.stage("construct"):
+                vocos.freeze_for_inference()
+            with timer.stage("deserialize"):
+                state_dict = torch.load(
+                    paths["vocos_frozen"],
+                    mmap=True,
+                    weights_only=True,
+                    map_location="cpu",
+                )
+                vocos.load_state_dict(state_dict, strict=True, assign=True)
+        else:
+            with timer.stage("deserialize"):
+                state_dict = torch.load(
+                    Path(paths["vocos_model"]), weights_only=True, map_location="cpu"
+                )
+                vocos.load_state_dict(state_dict, strict=True)
+            # the engine only runs inference, so the weight norms are baked in once
+            with timer.stage("construct"):
+                vocos.freeze_for_inference()
 
-# Init the model
-params = []
+        with timer.stage("to_device"):
+            return vocos.to(self.device)
 
-# Load the config
-update_params(config, params)
+    def _load_radtts(self, paths, timer):
+        from .radtts import RADTTS
 
-data_config = config["data_config"]
-model_config = config["model_config"]
+        # RADTTS writes into the nested model configs, keep the module one intact
+        model_config = deepcopy(config["model_config"])
+        # the alignment attention is only used for training
+        model_config["learn_alignments"] = False
 
-# Load vocoder
-vocos_config = hf_hub_download(
-    "patriotyk/vocos-mel-hifigan-compat-44100khz", "config.yaml"
-)
-vocos_model = hf_hub_download(
-    "patriotyk/vocos-mel-hifigan-compat-44100khz", "pytorch_model.bin"
-)
+        if "radtts_frozen" in paths:
+            # every weight is replaced by a mapped one, so none is allocated here
+            with timer.stage("construct"):
+                with torch.device("meta"):
+                    radtts = RADTTS(**model_config)
+                radtts.freeze_for_inference()
+            with timer.stage("deserialize"):
+                state_dict = torch.load(
+                    paths["radtts_frozen"],
+                    mmap=True,
+                    weights_only=True,
+                    map_location="cpu",
+                )
+                missing, unexpected = radtts.load_state_dict(
+                    state_dict, strict=False, assign=True
+                )
+                # weights exported before the inverse 1x1 conv weights were
+                # saved along lack only those, which are recomputed then
+                stale = [k for k in missing if not k.endswith(".W_inverse")]
+                if stale or unexpected:
+                    raise RuntimeError(
+                        "Frozen RAD-TTS weights do not match the model: "
+                        "missing {}, unexpected {}".format(stale, unexpected)
+                    )
+                if missing:
+                    radtts.enable_inverse_cache()
+        else:
+            with timer.stage("construct"):
+                radtts = RADTTS(**model_config)
+            with timer.stage("deserialize"):
+                checkpoint_dict = torch.load(
+                    Path(paths["radtts"]), weights_only=True, map_location="cpu"
+                )
+                radtts.load_state_dict(checkpoint_dict["state_dict"], strict=False)
+            with timer.stage("construct"):
+                radtts.freeze_for_inference()
 
-vocos_model_path = Path(vocos_model)
-state_dict = torch.load(vocos_model_path, weights_only=True, map_location="cpu")
+        with timer.stage("to_device"):
+            radtts = radtts.to(self.device)
+        radtts.concurrent_attributes = self.concurrent_attributes
+        return radtts
 
-vocos = Vocos.from_hparams(vocos_config).to(device)
-vocos.load_state_dict(state_dict, strict=True)
-vocos.eval()
+    def export(self, model_dir):
+        """Writes the frozen weights of both models into `model_dir`.
 
-# Load RAD-TTS
-radtts = RADTTS(**model_config).to(device)
-radtts.enable_inverse_cache()  # cache inverse matrix for 1x1 invertible convs
+        The files hold plain, parametrization-free tensors, which an engine
+        with this `model_dir` memory-maps instead of reading, so that worker
+        processes on one host share a single page-cache copy of the weights.
+        The Vocos config is copied along, so the directory is self-contained.
+        Existing files are replaced, not overwritten, so an engine, or a
+        worker process, that memory-maps them keeps working.
 
-radtts_model_path = Path("models/radtts-pp-dap-model/model_dap_84000_state.pt")
+        Returns:
+            dictionary mapping the names of `FROZEN_FILES` to the written paths
+        """
+        self.load()
 
-checkpoint_dict = torch.load(radtts_model_path, weights_only=True, map_location="cpu")
-state_dict = checkpoint_dict["state_dict"]
+        model_dir = Path(model_dir)
+        exported = {}
+        for name, model in (
+            ("radtts_frozen", self.radtts),
+            ("vocos_frozen", self.vocos),
+        ):
+            path = model_dir / FROZEN_FILES[name]
+            path.parent.mkdir(parents=True, exist_ok=True)
+            state_dict = {k: v.cpu() for k, v in model.state_dict().items()}
+            # the engine may have memory-mapped the file it replaces
+            write_file(path, lambda tmp_path: torch.save(state_dict, tmp_path))
+            exported[name] = str(path)
 
-radtts.load_state_dict(state_dict, strict=False)
-radtts.eval()
+        config_path = model_dir / MODEL_FILES["vocos_config"][2]
+        if not config_path.exists():
+            config_path.parent.mkdir(parents=True, exist_ok=True)
+            write_file(
+                config_path,
+                lambda tmp_path: shutil.copyfile(
+                    self.model_files["vocos_config"], tmp_path
+                ),
+            )
 
-radtts_params = f"{sum(param.numel() for param in radtts.parameters()):,}"
-vocos_params = f"{sum(param.numel() for param in vocos.parameters()):,}"
+        return exported
 
-print(f"Loaded checkpoint (RAD-TTS++), number of parameters: {radtts_params}")
-print(f"Loaded checkpoint (Vocos), number of parameters: {vocos_params}")
+    def speaker_tensor(self, voice):
+        """Maps a voice name, or a list of them, to a tensor of speaker ids"""
+        names = [voice] if isinstance(voice, str) else list(voice)
+        ids = []
+        for name in names:
+            name = name.lower()
+            if name not in self.voices:
+                raise ValueError(
+                    f"Unknown voice: {name}, choose one of: {', '.join(self.voices)}"
+                )
+            ids.append(self.voices[name])
+        return torch.LongTensor(ids).to(self.device)
 
-text_processor = TextProcessor(
-    data_config["training_files"],
-    **dict(
-        (k, v)
-        for k, v in data_config.items()
-        if k not in ["training_files", "validation_files"]
-    ),
-)
+    def encode_texts(self, texts):
+        """Encodes texts into zero-padded B x N tokens and their B lengths"""
+        tokens = [
+            torch.LongTensor(self.text_processor.tp.encode_text(text)) for text in texts
+        ]
+        in_lens = torch.LongTensor([len(t) for t in tokens])
+        tokens = torch.nn.utils.rnn.pad_sequence(tokens, batch_first=True)
+        return tokens.to(self.device), in_lens.to(self.device)
 
-voices = {
-    "lada": 0,
-    "mykyta": 1,
-    "tetiana": 2,
-}
+    def make_generator(self, seed):
+        """Returns a generator seeded with `seed`, or None to use the global one"""
+        if seed is None:
+            return None
+        return torch.Generator(device=self.device).manual_seed(seed)
 
+    def make_timer(self):
+        """Returns a fresh stage timer when profiling, otherwise None"""
+        if not self.profile:
+            return None
+        return StageTimer(self.device, synchronize=self.synchronize)
 
-def synthesis(
-    text,
-    voice,
-    n_takes,
-    use_latest_take,
-    token_dur_scaling,
-    f0_mean,
-    f0_std,
-    energy_mean,
-    energy_std,
-    sigma_decoder,
-    sigma_token_duration,
-    sigma_f0,
-    sigma_energy,
-):
-    if not text:
-        raise ValueError("Please paste your text.")
+    def trim_mels(self, outputs):
+        """Splits batched RAD-TTS outputs into per-item mels of their true length"""
+        n_group_size = self.radtts.n_group_size
+        n_frames = (outputs["out_lens"] // n_group_size) * n_group_size
+        return [
+            outputs["mel"][i : i + 1, :, :n] for i, n in enumerate(n_frames.tolist())
+        ]
+
+    def synthesis_stats(self, text, mels, wav_gen, n_tokens, inference_start, timer):
+        duration = len(wav_gen[0]) / self.sampling_rate
+
+        elapsed_time = time.time() - inference_start
+        rtf = elapsed_time / duration
+
+        speed_ratio = duration / elapsed_time
+        speech_rate = len(text.split(" ")) / duration
+
+        return {
+            "rtf": rtf,
+            "time": elapsed_time,
+            "audio_duration": duration,
+            "speed_ratio": speed_ratio,
+            "speech_rate": speech_rate,
+            "n_tokens": n_tokens,
+            "n_frames": sum(mel.shape[2] for mel in mels),
+            **self.stage_stats(timer),
+        }
+
+    @staticmethod
+    def stage_stats(timer):
+        if timer is None:
+            return {}
+        return {"stages": dict(timer.stages)}
+
+    def estimate(
+        self,
+        text,
+        voice,
+        token_dur_scaling=1,
+        sigma_token_duration=0.666,
+        seed=None,
+    ):
+        """Predicts the length and the compute cost of synthesizing `text`.
+
+        Only the text encoder and the duration predictor are run, which is a
+        small fraction of a synthesis call, so every request can be estimated
+        before it is admitted or batched. With the same `seed`, the predicted
+        durations are the ones a `synthesis` take would use.
+
+        Returns:
+            dictionary with the number of tokens, mel frames and seconds of
+            audio, and the estimated multiply-accumulates of every stage
+            ("macs") and in total ("total_macs")
+        """
+        if not text:
+            raise ValueError("Please paste your text.")
 
-    speaker = speaker_text = speaker_attributes = voice.lower()
+        self.load()
 
-    tensor_text = torch.LongTensor(text_processor.tp.encode_text(text)).to(device)
-    speaker_tensor = torch.LongTensor([voices[speaker]]).to(device)
+        tokens = torch.LongTensor(self.text_processor.tp.encode_text(text))
+        with torch.autocast(self.device_type, enabled=False):
+            with torch.inference_mode():
+                _, out_lens = self.radtts.infer_durations(
+                    self.speaker_tensor(voice.lower()),
+                    tokens[None].to(self.device),
+                    sigma_token_duration,
+                    token_dur_scaling,
+                    token_duration_max=100,
+                    generator=self.make_generator(seed),
+                )
+
+        # as kept by `trim_mels`
+        n_group_size = self.radtts.n_group_size
+        n_frames = int(out_lens[0]) // n_group_size * n_group_size
+        n_tokens = len(tokens)
 
-    speaker_id = speaker_id_text = speaker_id_attributes = speaker_tensor
+        macs = {
+            stage: per_token * n_tokens + per_frame * n_frames
+            for stage, (per_token, per_frame) in self.stage_macs.items()
+        }
+        return {
+            "n_tokens": n_tokens,
+            "n_frames": n_frames,
+            "audio_duration": (
+                n_frames * self.vocos.head.istft.hop_length / self.sampling_rate
+            ),
+            "macs": macs,
+            "total_macs": sum(macs.values()),
+        }
 
-    if speaker_text is not None:
-        speaker_id_text = torch.LongTensor([voices[speaker_text]]).to(device)
+    def prosody_cache_key(
+        self,
+        text_clean,
+        voice,
+        n_samples,
+        token_dur_scaling,
+        f0_mean,
+        f0_std,
+        sigma_token_duration,
+        sigma_f0,
+        sigma_energy,
+        seed,
+    ):
+        # everything the predictors depend on, but not the decoder settings
+        return make_cache_key(
+            kind="prosody",
+            model=self.model_fingerprint,
+            device=self.device_type,
+            text=text_clean,
+            voice=voice.lower(),
+            n_samples=n_samples,
+            token_dur_scaling=token_dur_scaling,
+            f0_mean=f0_mean,
+            f0_std=f0_std,
+            sigma_token_duration=sigma_token_duration,
+            sigma_f0=sigma_f0,
+            sigma_energy=sigma_energy,
+            seed=seed,
+        )
+
+    def predict_prosody(
+        self,
+        text,
+        voice,
+        n_takes=1,
+        token_dur_scaling=1,
+        f0_mean=0,
+        f0_std=0,
+        sigma_token_duration=0.666,
+        sigma_f0=1,
+        sigma_energy=1,
+        seed=None,
+    ):
+        """Predicts the `Prosody` of `n_takes` takes of `text`.
+
+        Only the text encoder and the duration and attribute predictors are
+        run. With a `seed`, this is the prosody `synthesis` uses for the same
+        arguments and seed; passing it back as its `prosody` skips these
+        predictors, whatever the decoder settings. Seeded results are kept in
+        the `prosody_cache`, if the engine has one.
+        """
+        if not text:
+            raise ValueError("Please paste your text.")
 
-    if speaker_attributes is not None:
-        speaker_id_attributes = torch.LongTensor([voices[speaker_attributes]]).to(
-            device
+        self.load()
+
+        text_encoded, text_clean = self.text_processor.tp.encode_text(
+            text, return_all=True
         )
 
-    inference_start = time.time()
+        cache_key = None
+        if self.prosody_cache is not None and seed is not None:
+            cache_key = self.prosody_cache_key(
+                text_clean,
+                voice,
+                n_takes,
+                token_dur_scaling,
+                f0_mean,
+                f0_std,
+                sigma_token_duration,
+                sigma_f0,
+                sigma_energy,
+                seed,
+            )
+            prosody = self.prosody_cache.get(cache_key)
+            if prosody is not None:
+                return prosody
+
+        speaker_id = self.speaker_tensor(voice.lower())
+        with torch.autocast(self.device_type, enabled=False):
+            with torch.inference_mode():
+                outputs = self.radtts.infer(
+                    speaker_id,
+                    torch.LongTensor(text_encoded).to(self.device)[None],
+                    0.0,
+                    sigma_token_duration,
+                    sigma_f0,
+                    sigma_energy,
+                    token_dur_scaling,
+                    token_duration_max=100,
+                    speaker_id_text=speaker_id,
+                    speaker_id_attributes=speaker_id,
+                    f0_mean=f0_mean,
+                    f0_std=f0_std,
+                    n_samples=n_takes,
+                    prosody_only=True,
+                    generator=self.make_generator(seed),
+                )
+        prosody = Prosody.from_outputs(outputs)
+
+        if cache_key is not None:
+            self.prosody_cache.put(cache_key, prosody)
+
+        return prosody
+
+    def synthesis(
+        self,
+        text,
+        voice,
+        n_takes,
+        use_latest_take,
+        token_dur_scaling,
+        f0_mean,
+        f0_std,
+        energy_mean,
+        energy_std,
+        sigma_decoder,
+        sigma_token_duration,
+        sigma_f0,
+        sigma_energy,
+        seed=None,
+        prosody=None,
+    ):
+        if not text:
+            raise ValueError("Please paste your text.")
+
+        self.load()
+
+        inference_start = time.time()
+        timer = self.make_timer()
+
+        # takes are independent samples, so only the one that is kept is drawn
+        n_samples = 1 if use_latest_take else n_takes
+
+        with time_stage(timer, "text_processing"):
+            text_encoded, text_clean = self.text_processor.tp.encode_text(
+                text, return_all=True
+            )
+            tensor_text = torch.LongTensor(text_encoded).to(self.device)
+        n_tokens = len(text_encoded)
+
+        if prosody is not None and (
+            len(prosody) != n_samples or prosody.n_tokens != n_tokens
+        ):
+            raise ValueError(
+                f"The prosody is for {len(prosody)} take(s) of {prosody.n_tokens} "
+                f"tokens, not {n_samples} of {n_tokens}"
+            )
+
+        # unseeded results are random, so only seeded ones can be reused; a
+        # given prosody replaces the predictors, which the key describes
+        cache_key = None
+        if self.cache is not None and seed is not None and prosody is None:
+            # seeded noise differs between device types
+            cache_key = make_cache_key(
+                model=self.model_fingerprint,
+                device=self.device_type,
+                text=text_clean,
+                voice=voice.lower(),
+                n_samples=n_samples,
+                token_dur_scaling=token_dur_scaling,
+                f0_mean=f0_mean,
+                f0_std=f0_std,
+                energy_mean=energy_mean,
+                energy_std=energy_std,
+                sigma_decoder=sigma_decoder,
+                sigma_token_duration=sigma_token_duration,
+                sigma_f0=sigma_f0,
+                sigma_energy=sigma_energy,
+                seed=seed,
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                mels, wav_gen = cached
+                mels = [mel.to(self.device) for mel in mels]
+                wav_gen = wav_gen.to(self.device)
+                stats = self.synthesis_stats(
+                    text, mels, wav_gen, n_tokens, inference_start, timer
+                )
+                stats["cached"] = True
+                return [mels, wav_gen, stats]
+
+        speaker = speaker_text = speaker_attributes = voice.lower()
+
+        speaker_tensor = self.speaker_tensor(speaker)
+
+        speaker_id = speaker_id_text = speaker_id_attributes = speaker_tensor
+
+        if speaker_text is not None:
+            speaker_id_text = self.speaker_tensor(speaker_text)
+
+        if speaker_attributes is not None:
+            speaker_id_attributes = self.speaker_tensor(speaker_attributes)
+
+        prosody_key = None
+        if prosody is None and self.prosody_cache is not None and seed is not None:
+            prosody_key = self.prosody_cache_key(
+                text_clean,
+                voice,
+                n_samples,
+                token_dur_scaling,
+                f0_mean,
+                f0_std,
+                sigma_token_duration,
+                sigma_f0,
+                sigma_energy,
+                seed,
+            )
+            prosody = self.prosody_cache.get(prosody_key)
+            if prosody is not None:
+                prosody_key = None
 
-    mels = []
-    for n_take in range(n_takes):
-        print(f"Inferencing take {n_take + 1}")
+        prosody_kwargs = {}
+        if prosody is not None:
+            prosody_kwargs = prosody.infer_kwargs(self.device)
+            # the F0 of a prosody is already renormalized
+            f0_mean = f0_std = 0
 
-        with torch.autocast(device, enabled=False):
+        print(f"Inferencing {n_samples} take(s)")
+
+        with torch.autocast(self.device_type, enabled=False):
             with torch.inference_mode():
-                outputs = radtts.infer(
+                outputs = self.radtts.infer(
                     speaker_id,
                     tensor_text[None],
                     sigma_decoder,
@@ -157,33 +808,335 @@ def synthesis(
                     f0_std=f0_std,
                     energy_mean=energy_mean,
                     energy_std=energy_std,
+                    n_samples=n_samples,
+                    flow_memory_budget=self.flow_memory_budget,
+                    generator=self.make_generator(seed),
+                    timer=timer,
+                    **prosody_kwargs,
                 )
+                if prosody_key is not None:
+                    self.prosody_cache.put(prosody_key, Prosody.from_outputs(outputs))
+                mels = self.trim_mels(outputs)
+                del outputs
 
-                mels.append(outputs["mel"])
+        # vocode all takes in one batch
+        wav_gen_all = self.vocos.decode_batch(mels, timer=timer)
+        wav_gen = torch.cat(wav_gen_all, dim=1)  # Concatenate all the generated wavs
 
-    wav_gen_all = []
-    for mel in mels:
-        wav_gen_all.append(vocos.decode(mel))
+        if cache_key is not None:
+            self.cache.put(cache_key, mels, wav_gen)
 
-    if use_latest_take:
-        wav_gen = wav_gen_all[-1]  # Get the latest generated wav
-    else:
-        wav_gen = torch.cat(wav_gen_all, dim=1)  # Concatenate all the generated wavs
+        stats = self.synthesis_stats(
+            text, mels, wav_gen, n_tokens, inference_start, timer
+        )
+        stats["cached"] = False
+
+        return [mels, wav_gen, stats]
+
+    def synthesize_batch(
+        self,
+        texts,
+        voices,
+        token_dur_scaling=1,
+        f0_mean=0,
+        f0_std=0,
+        sigma_decoder=0.8,
+        sigma_token_duration=0.666,
+        sigma_f0=1,
+        sigma_energy=1,
+        seed=None,
+    ):
+        """Synthesizes several texts with one batched RAD-TTS pass.
+
+        `voices` is either one voice for all texts or a voice per text. The
+        other parameters are scalars or sequences with a value per text.
+        Passing a `seed` makes the whole batch reproducible.
+
+        Returns:
+            mels: list of 1 x n_mel_channels x frames mels, one per text
+            waves: list of 1 x samples waveforms, one per text
+            stats: dictionary with the statistics of the whole batch
+        """
+        if not texts or not all(texts):
+            raise ValueError("Please paste your text.")
+
+        self.load()
+
+        batch_size = len(texts)
+        if not isinstance(voices, str) and len(voices) != batch_size:
+            raise ValueError("Expected one voice or a voice per text.")
+
+        inference_start = time.time()
+        timer = self.make_timer()
+
+        with time_stage(timer, "text_processing"):
+            tokens, in_lens = self.encode_texts(texts)
+        speaker_id = self.speaker_tensor(voices)
+
+        with torch.autocast(self.device_type, enabled=False):
+            with torch.inference_mode():
+                outputs = self.radtts.infer(
+                    speaker_id,
+                    tokens,
+                    sigma_decoder,
+                    sigma_token_duration,
+                    sigma_f0,
+                    sigma_energy,
+                    token_dur_scaling,
+                    token_duration_max=100,
+                    f0_mean=f0_mean,
+                    f0_std=f0_std,
+                    in_lens=in_lens,
+                    flow_memory_budget=self.flow_memory_budget,
+                    generator=self.make_generator(seed),
+                    timer=timer,
+                )
+                mels = self.trim_mels(outputs)
+
+        waves = self.vocos.decode_batch(mels, timer=timer)
 
-    duration = len(wav_gen[0]) / 44_100
+        duration = sum(wave.shape[1] for wave in waves) / self.sampling_rate
+        elapsed_time = time.time() - inference_start
 
-    elapsed_time = time.time() - inference_start
-    rtf = elapsed_time / duration
+        stats = {
+            "rtf": elapsed_time / duration,
+            "time": elapsed_time,
+            "audio_duration": duration,
+            "speed_ratio": duration / elapsed_time,
+            "batch_size": batch_size,
+            "n_tokens": int(in_lens.sum()),
+            "n_frames": sum(mel.shape[2] for mel in mels),
+            **self.stage_stats(timer),
+        }
 
-    speed_ratio = duration / elapsed_time
-    speech_rate = len(text.split(" ")) / duration
+        return [mels, waves, stats]
 
-    stats = {
-        "rtf": rtf,
-        "time": elapsed_time,
-        "audio_duration": duration,
-        "speed_ratio": speed_ratio,
-        "speech_rate": speech_rate,
-    }
+    def synthesize_fanout(self, texts, voices=None, variants=({},), seed=None):
+        """Renders texts in several voices and parameter variants at once.
 
-    return [mels, wav_gen, stats]
+        Every text is encoded once, then expanded into an item per (voice,
+        variant); the speaker-dependent stages (durations, attributes, flows
+        and Vocos) run over all items as one batch. A variant is a dictionary
+        setting some of the parameters of `fanout_defaults`.
+
+        Args:
+            texts (str or list): Text, or texts, to render.
+            voices (list, optional): Voices to render every text in, defaults
+                to all of them.
+            variants (list): Parameter variants to render every voice in.
+            seed (int, optional): Seed making the whole fan-out reproducible.
+
+        Returns:
+            mels: list of 1 x n_mel_channels x frames mels, one per item
+            waves: list of 1 x samples waveforms, one per item
+            stats: dictionary with the statistics of the whole fan-out; its
+                "items" holds the (text index, voice, variant index) of every
+                item, ordered by text, then voice, then variant
+        """
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        if not texts or not all(texts):
+            raise ValueError("Please paste your text.")
+
+        variants = list(variants)
+        unknown = set().union(*variants) - set(fanout_defaults)
+        if not variants or unknown:
+            raise ValueError(
+                f"Expected variants setting some of: {', '.join(fanout_defaults)}"
+            )
+        variants = [{**fanout_defaults, **variant} for variant in variants]
+
+        self.load()
+
+        if voices is None:
+            voices = list(self.voices)
+        elif isinstance(voices, str):
+            voices = [voices]
+        items = [
+            (i, voice.lower(), j)
+            for i in range(len(texts))
+            for voice in voices
+            for j in range(len(variants))
+        ]
+        n_samples = len(voices) * len(variants)
+        params = {
+            name: [variants[j][name] for _, _, j in items] for name in fanout_defaults
+        }
+
+        inference_start = time.time()
+        timer = self.make_timer()
+
+        with time_stage(timer, "text_processing"):
+            tokens, in_lens = self.encode_texts(texts)
+        speaker_id = self.speaker_tensor([voice for _, voice, _ in items])
+
+        with torch.autocast(self.device_type, enabled=False):
+            with torch.inference_mode():
+                outputs = self.radtts.infer(
+                    speaker_id,
+                    tokens,
+                    params["sigma_decoder"],
+                    params["sigma_token_duration"],
+                    params["sigma_f0"],
+                    params["sigma_energy"],
+                    params["token_dur_scaling"],
+                    token_duration_max=100,
+                    f0_mean=params["f0_mean"],
+                    f0_std=params["f0_std"],
+                    in_lens=in_lens,
+                    n_samples=n_samples,
+                    flow_memory_budget=self.flow_memory_budget,
+                    generator=self.make_generator(seed),
+                    timer=timer,
+                )
+                mels = self.trim_mels(outputs)
+
+        waves = self.vocos.decode_batch(mels, timer=timer)
+
+        duration = sum(wave.shape[1] for wave in waves) / self.sampling_rate
+        elapsed_time = time.time() - inference_start
+
+        stats = {
+            "rtf": elapsed_time / duration,
+            "time": elapsed_time,
+            "audio_duration": duration,
+            "speed_ratio": duration / elapsed_time,
+            "batch_size": len(items),
+            "items": items,
+            "n_tokens": int(in_lens.sum()),
+            "n_frames": sum(mel.shape[2] for mel in mels),
+            **self.stage_stats(timer),
+        }
+
+        return [mels, waves, stats]
+
+    def synthesize_stream(
+        self,
+        text,
+        voice,
+        token_dur_scaling=1,
+        f0_mean=0,
+        f0_std=0,
+        sigma_decoder=0.8,
+        sigma_token_duration=0.666,
+        sigma_f0=1,
+        sigma_energy=1,
+        silence_duration=0.0,
+        seed=None,
+    ):
+        """Synthesizes text sentence by sentence, yielding audio as it is ready.
+
+        The text is split at whitespace after `.`, `?` and `!`, and every
+        sentence goes through RAD-TTS and Vocos on its own, so the first chunk
+        is available long before the whole text is synthesized.
+
+        Args:
+            silence_duration (float): Seconds of silence put before every
+                chunk but the first one.
+            seed (int, optional): Seed making the whole stream reproducible.
+
+        Yields:
+            wave: 1 x samples waveform of the next sentence
+            stats: running statistics, including `time_to_first_chunk`
+        """
+        if not text:
+            raise ValueError("Please paste your text.")
+
+        self.load()
+
+        inference_start = time.time()
+
+        speaker_id = self.speaker_tensor(voice)
+        generator = self.make_generator(seed)
+        silence = torch.zeros(
+            1, int(silence_duration * self.sampling_rate), device=self.device
+        )
+
+        time_to_first_chunk = None
+        duration = 0.0
+        sentences = split_sentences(text)
+        for i, sentence in enumerate(sentences):
+            timer = self.make_timer()
+            with time_stage(timer, "text_processing"):
+                tokens, in_lens = self.encode_texts([sentence])
+
+            with torch.autocast(self.device_type, enabled=False):
+                with torch.inference_mode():
+                    outputs = self.radtts.infer(
+                        speaker_id,
+                        tokens,
+                        sigma_decoder,
+                        sigma_token_duration,
+                        sigma_f0,
+                        sigma_energy,
+                        token_dur_scaling,
+                        token_duration_max=100,
+                        f0_mean=f0_mean,
+                        f0_std=f0_std,
+                        flow_memory_budget=self.flow_memory_budget,
+                        generator=generator,
+                        timer=timer,
+                    )
+
+            wave = self.vocos.decode(outputs["mel"], timer=timer)
+            if i > 0 and silence.shape[1] > 0:
+                wave = torch.cat((silence, wave), dim=1)
+
+            elapsed_time = time.time() - inference_start
+            if time_to_first_chunk is None:
+                time_to_first_chunk = elapsed_time
+            duration += wave.shape[1] / self.sampling_rate
+
+            stats = {
+                "chunk": i,
+                "n_chunks": len(sentences),
+                "text": sentence,
+                "time_to_first_chunk": time_to_first_chunk,
+                "rtf": elapsed_time / duration,
+                "time": elapsed_time,
+                "audio_duration": duration,
+                "n_tokens": tokens.shape[1],
+                "n_frames": outputs["mel"].shape[2],
+                **self.stage_stats(timer),
+            }
+
+            yield wave, stats
+
+
+# Shared engine behind the module-level `synthesis` function, loaded on first use
+default_engine = TTSEngine()
+
+
+def synthesis(
+    text,
+    voice,
+    n_takes,
+    use_latest_take,
+    token_dur_scaling,
+    f0_mean,
+    f0_std,
+    energy_mean,
+    energy_std,
+    sigma_decoder,
+    sigma_token_duration,
+    sigma_f0,
+    sigma_energy,
+    seed=None,
+    prosody=None,
+):
+    return default_engine.synthesis(
+        text,
+        voice,
+        n_takes,
+        use_latest_take,
+        token_dur_scaling,
+        f0_mean,
+        f0_std,
+        energy_mean,
+        energy_std,
+        sigma_decoder,
+        sigma_token_duration,
+        sigma_f0,
+        sigma_energy,
+        seed=seed,
+        prosody=prosody,
+    )
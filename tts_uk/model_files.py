@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+
+RADTTS_REPO_ID = "Yehor/radtts-uk"
+RADTTS_FILENAME = "radtts-pp-dap-model/model_dap_84000_state.pt"
+
+VOCOS_REPO_ID = "patriotyk/vocos-mel-hifigan-compat-44100khz"
+
+MANIFEST_FILENAME = "manifest.json"
+
+# name: (repo id, file in the repo, path inside a local model directory)
+MODEL_FILES = {
+    "radtts": (RADTTS_REPO_ID, RADTTS_FILENAME, RADTTS_FILENAME),
+    "vocos_config": (VOCOS_REPO_ID, "config.yaml", "vocos/config.yaml"),
+    "vocos_model": (VOCOS_REPO_ID, "pytorch_model.bin", "vocos/pytorch_model.bin"),
+}
+
+# name: path inside a local model directory of the frozen weights written by
+# `TTSEngine.export`, which replace the checkpoints when both are present
+FROZEN_FILES = {
+    "radtts_frozen": "frozen/radtts.pt",
+    "vocos_frozen": "frozen/vocos.pt",
+}
+
+
+def download_file_from_repo(
+    repo_id: str,
+    filename: str,
+    local_dir: str = ".",
+    repo_type: str = "model",
+) -> str:
+    from huggingface_hub import hf_hub_download
+
+    try:
+        os.makedirs(local_dir, exist_ok=True)
+
+        file_path = hf_hub_download(
+            repo_id=repo_id,
+            filename=filename,
+            local_dir=local_dir,
+            cache_dir=None,
+            force_download=False,
+            repo_type=repo_type,
+        )
+
+        return file_path
+    except Exception as e:
+        raise Exception(f"An error occurred during download: {e}") from e
+
+
+def fetch_file(repo_id, filename, local_dir=None):
+    """Returns a hub file, asking the hub only if it is not downloaded yet"""
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.errors import LocalEntryNotFoundError
+
+    kwargs = {} if local_dir is None else {"local_dir": local_dir}
+    try:
+        return hf_hub_download(repo_id, filename, local_files_only=True, **kwargs)
+    except LocalEntryNotFoundError:
+        pass
+    if local_dir is not None:
+        return download_file_from_repo(repo_id, filename, local_dir)
+    return hf_hub_download(repo_id, filename)
+
+
+def file_sha256(path):
+    # the size and modification time make a rewritten file hash again
+    stat = os.stat(path)
+    return _file_sha256(os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=None)
+def _file_sha256(path, size, mtime_ns):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def model_fingerprint(paths):
+    """Hashes the sha256 of every `name: path` of `paths` into one hex digest"""
+    hashes = {name: file_sha256(path) for name, path in sorted(paths.items())}
+    return hashlib.sha256(json.dumps(hashes).encode("utf-8")).hexdigest()
+
+
+def write_manifest(paths, manifest_path):
+    """Records the sha256 of each `name: path` of `paths` in a JSON manifest"""
+    manifest = {name: file_sha256(path) for name, path in sorted(paths.items())}
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+    return manifest
+
+
+def verify_model_files(paths, manifest_path):
+    """Checks the files of `paths` against the hashes of a manifest"""
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    for name, path in paths.items():
+        if name not in manifest:
+            continue
+        if file_sha256(path) != manifest[name]:
+            raise ValueError(f"Checksum mismatch for {name}: {path}")
+
+
+def resolve_model_files(
+    model_dir=None, paths=None, local_dir="./models/", manifest=None
+):
+    """Finds the RAD-TTS checkpoint and the Vocos config and weights.
+
+    Explicit `paths` win, then files laid out as in `MODEL_FILES` under
+    `model_dir`, then earlier downloads; the hub is only contacted for files
+    that are found nowhere. If frozen weights (`FROZEN_FILES`) are found, the
+    original checkpoints are not needed and only the Vocos config is looked
+    up. Files are checked against `manifest`, or against `manifest.json` of
+    `model_dir` if it has one.
+
+    Returns:
+        dictionary mapping the names of `MODEL_FILES` and `FROZEN_FILES` to
+        local paths
+    """
+    paths = dict(paths or {})
+    unknown = set(paths) - set(MODEL_FILES) - set(FROZEN_FILES)
+    if unknown:
+        raise ValueError(f"Unknown model files: {', '.join(sorted(unknown))}")
+
+    for name, path in paths.items():
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Model file for {name} not found: {path}")
+
+    if model_dir is not None:
+        for name, local_name in FROZEN_FILES.items():
+            path = Path(model_dir) / local_name
+            if name not in paths and path.is_file():
+                paths[name] = str(path)
+
+    required = MODEL_FILES
+    if all(name in paths for name in FROZEN_FILES):
+        required = {"vocos_config": MODEL_FILES["vocos_config"]}
+
+    for name, (repo_id, filename, local_name) in required.items():
+        if name in paths:
+            continue
+        if model_dir is not None:
+            path = Path(model_dir) / local_name
+            if path.is_file():
+                paths[name] = str(path)
+                continue
+        # the RAD-TTS checkpoint is kept in `local_dir`, Vocos in the hub cache
+        paths[name] = fetch_file(
+            repo_id, filename, local_dir if name == "radtts" else None
+        )
+
+    if manifest is None and model_dir is not None:
+        path = Path(model_dir) / MANIFEST_FILENAME
+        if path.is_file():
+            manifest = path
+    if manifest is not None:
+        verify_model_files(paths, manifest)
+
+    return paths
@@ -21,56 +21,69 @@ class PartialConv1d(torch.nn.Conv1d):
         self.return_mask = False
         super(PartialConv1d, self).__init__(*args, **kwargs)
 
-        self.weight_maskUpdater = torch.ones(1, 1, self.kernel_size[0])
+        # not a weight, so it is created for real even when building on "meta"
+        # and left out of the checkpoints; it moves with the model
+        self.register_buffer(
+            "weight_maskUpdater",
+            torch.ones(1, 1, self.kernel_size[0], device="cpu"),
+            persistent=False,
+        )
         self.slide_winsize = (
             self.weight_maskUpdater.shape[1] * self.weight_maskUpdater.shape[2]
         )
 
-        self.last_size = (None, None, None)
-        self.update_mask = None
-        self.mask_ratio = None
+    def get_mask_ratios(self, mask):
+        """Returns the update mask and the output rescaling ratio of a
+        B x 1 x T mask of the valid input values
+        """
+        with torch.no_grad():
+            update_mask = F.conv1d(
+                mask,
+                self.weight_maskUpdater.to(mask),
+                bias=None,
+                stride=self.stride,
+                padding=self.padding,
+                dilation=self.dilation,
+                groups=1,
+            )
+            # for mixed precision training, change 1e-8 to 1e-6
+            mask_ratio = self.slide_winsize / (update_mask + 1e-6)
+            update_mask = torch.clamp(update_mask, 0, 1)
+            mask_ratio = torch.mul(mask_ratio, update_mask)
+        return update_mask, mask_ratio
 
     @torch.jit.ignore
-    def forward(self, input: torch.Tensor, mask_in: torch.Tensor = None):
+    def forward(
+        self, input: torch.Tensor, mask_in: torch.Tensor = None, mask_ratios=None
+    ):
         """
         input: standard input to a 1D conv
         mask_in: binary mask for valid values, same shape as input
+        mask_ratios: precomputed (update_mask, mask_ratio) of `mask_in`, see
+            `get_mask_ratios`; masks that are None are not applied
+
+        Nothing is stored on the module, so concurrent calls are safe.
         """
         assert len(input.shape) == 3
-        # if a mask is input, or tensor shape changed, update mask ratio
-        if mask_in is not None or self.last_size != tuple(input.shape):
-            self.last_size = tuple(input.shape)
-            with torch.no_grad():
-                if self.weight_maskUpdater.type() != input.type():
-                    self.weight_maskUpdater = self.weight_maskUpdater.to(input)
-                if mask_in is None:
-                    mask = torch.ones(1, 1, input.data.shape[2]).to(input)
-                else:
-                    mask = mask_in
-                self.update_mask = F.conv1d(
-                    mask,
-                    self.weight_maskUpdater,
-                    bias=None,
-                    stride=self.stride,
-                    padding=self.padding,
-                    dilation=self.dilation,
-                    groups=1,
-                )
-                # for mixed precision training, change 1e-8 to 1e-6
-                self.mask_ratio = self.slide_winsize / (self.update_mask + 1e-6)
-                self.update_mask = torch.clamp(self.update_mask, 0, 1)
-                self.mask_ratio = torch.mul(self.mask_ratio, self.update_mask)
+        if mask_ratios is not None:
+            update_mask, mask_ratio = mask_ratios
+        else:
+            mask = mask_in
+            if mask is None:
+                mask = torch.ones(1, 1, input.data.shape[2]).to(input)
+            update_mask, mask_ratio = self.get_mask_ratios(mask)
         raw_out = super(PartialConv1d, self).forward(
-            torch.mul(input, mask) if mask_in is not None else input
+            torch.mul(input, mask_in) if mask_in is not None else input
         )
         if self.bias is not None:
             bias_view = self.bias.view(1, self.out_channels, 1)
-            output = torch.mul(raw_out - bias_view, self.mask_ratio) + bias_view
-            output = torch.mul(output, self.update_mask)
+            output = torch.mul(raw_out - bias_view, mask_ratio) + bias_view
+            if update_mask is not None:
+                output = torch.mul(output, update_mask)
         else:
-            output = torch.mul(raw_out, self.mask_ratio)
+            output = torch.mul(raw_out, mask_ratio)
 
         if self.return_mask:
-            return output, self.update_mask
+            return output, update_mask
         else:
             return output
@@ -0,0 +1,76 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+import torch
+from torch import nn
+
+
+def synchronize(device):
+    """Waits for the queued kernels of an asynchronous device to finish"""
+    device_type = torch.device(device).type
+    if device_type == "cuda":
+        torch.cuda.synchronize(device)
+    elif device_type == "mps":
+        torch.mps.synchronize()
+
+
+class StageTimer:
+    """Accumulates wall-clock time per named stage of a synthesis call.
+
+    CUDA and MPS kernels run asynchronously, so without `synchronize` a stage
+    is only charged for launching its work. With it, the device is synchronized
+    around every stage, which gives an accurate breakdown at some cost.
+
+    Args:
+        device (str): Device the timed work runs on.
+        synchronize (bool): Synchronize the device before and after each stage.
+    """
+
+    def __init__(self, device="cpu", synchronize=False):
+        self.device = device
+        self.synchronize = synchronize
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        if self.synchronize:
+            synchronize(self.device)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.synchronize:
+                synchronize(self.device)
+            self.stages[name] = self.stages.get(name, 0.0) + (
+                time.perf_counter() - start
+            )
+
+
+def count_macs(modules):
+    """Multiply-accumulates the convs, linear layers and LSTMs of `modules` do
+    per step of their input, e.g. per frame of a conv with stride 1.
+
+    A bidirectional LSTM does both directions at every step. Other work
+    (norms, activations, the 1x1 convs built from factors) is not counted.
+    """
+    if isinstance(modules, nn.Module):
+        modules = [modules]
+    macs = 0
+    for module in modules:
+        for m in module.modules():
+            if isinstance(m, nn.RNNBase):
+                macs += sum(
+                    getattr(m, name).numel()
+                    for name in m._flat_weights_names
+                    if name.startswith("weight")
+                )
+            elif isinstance(m, (nn.Conv1d, nn.Linear)):
+                macs += m.weight.numel()
+    return macs
+
+
+def time_stage(timer, name):
+    """Times a block as stage `name` of `timer`, or does nothing without one"""
+    if timer is None:
+        return nullcontext()
+    return timer.stage(name)
@@ -0,0 +1,82 @@
+import torch
+
+
+class Prosody:
+    """Token durations, F0, energy and voicing of a RAD-TTS synthesis call.
+
+    These are the inputs the flow decoder is conditioned on, so passing them
+    back to `RADTTS.infer` skips the duration and attribute predictors. Every
+    tensor has one row per synthesized item and is kept on the CPU; the
+    attributes are None for a model that does not predict them.
+
+    Args:
+        dur (Tensor): B x N integer token durations.
+        f0 (Tensor, optional): B x T F0, already renormalized.
+        energy_avg (Tensor, optional): B x T energy.
+        voiced_mask (Tensor, optional): B x T voicing, as booleans or 0/1.
+    """
+
+    fields = ("dur", "f0", "energy_avg", "voiced_mask")
+
+    def __init__(self, dur, f0=None, energy_avg=None, voiced_mask=None):
+        self.dur = dur.detach().to("cpu", torch.int32)
+        self.f0 = None if f0 is None else f0.detach().to("cpu", torch.float32)
+        self.energy_avg = (
+            None if energy_avg is None else energy_avg.detach().to("cpu", torch.float32)
+        )
+        self.voiced_mask = (
+            None if voiced_mask is None else voiced_mask.detach().to("cpu").bool()
+        )
+
+    @classmethod
+    def from_outputs(cls, outputs):
+        """Takes the prosody out of the outputs of `RADTTS.infer`"""
+        return cls(*(outputs[name] for name in cls.fields))
+
+    def __len__(self):
+        return self.dur.shape[0]
+
+    @property
+    def n_tokens(self):
+        return self.dur.shape[1]
+
+    @property
+    def out_lens(self):
+        return self.dur.sum(1).long()
+
+    @property
+    def n_bytes(self):
+        tensors = [getattr(self, name) for name in self.fields]
+        return sum(t.numel() * t.element_size() for t in tensors if t is not None)
+
+    def __repr__(self):
+        return (
+            f"Prosody(n_items={len(self)}, n_tokens={self.n_tokens}, "
+            f"n_frames={self.out_lens.tolist()})"
+        )
+
+    def infer_kwargs(self, device):
+        """Returns the `dur`, `f0`, `energy_avg` and `voiced_mask` arguments of
+        `RADTTS.infer` on `device`"""
+        kwargs = {name: getattr(self, name) for name in self.fields}
+        if kwargs["voiced_mask"] is not None:
+            kwargs["voiced_mask"] = kwargs["voiced_mask"].float()
+        # clones, as `infer` renormalizes and pads some of them in place
+        return {
+            name: None if value is None else value.to(device, copy=True)
+            for name, value in kwargs.items()
+        }
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.fields}
+
+    @classmethod
+    def from_dict(cls, entry):
+        return cls(**entry)
+
+    def save(self, path):
+        torch.save(self.to_dict(), path)
+
+    @classmethod
+    def load(cls, path):
+        return cls.from_dict(torch.load(path, weights_only=True, map_location="cpu"))
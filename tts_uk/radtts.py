@@ -19,12 +19,18 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+from concurrent.futures import ThreadPoolExecutor
+
 import torch
 from torch import nn
 
-from .alignment import mas_width1 as mas
-from .attribute_prediction_model import get_attribute_prediction_model
+from .attribute_prediction_model import (
+    DAP,
+    get_attribute_prediction_model,
+    infer_bottlenecks,
+)
 from .common import (
+    WN,
     AffineTransformationLayer,
     ConvAttention,
     Encoder,
@@ -33,9 +39,35 @@ from .common import (
     Invertible1x1ConvLUS,
     LengthRegulator,
     LinearNorm,
+    MaskContext,
     get_mask_from_lengths,
+    remove_parametrizations,
 )
-from .torch_env import device
+from .profiling import count_macs, time_stage
+
+
+def get_per_item_values(value, batch_size, device):
+    """Broadcasts a scalar or a sequence of per-item values to a B tensor"""
+    value = torch.as_tensor(value, dtype=torch.float32, device=device).flatten()
+    if value.numel() == 1:
+        value = value.expand(batch_size)
+    if value.numel() != batch_size:
+        raise ValueError(
+            "Expected a scalar or {} per-item values, got {}".format(
+                batch_size, value.numel()
+            )
+        )
+    return value
+
+
+# runs the energy predictor next to the F0 one, see `RADTTS.infer_f0_and_energy`
+attribute_executor = ThreadPoolExecutor(thread_name_prefix="radtts-attributes")
+
+
+def run_in_grad_mode(fn, inference_mode, grad_enabled):
+    # grad and inference modes are per thread, so a worker has to set them
+    with torch.inference_mode(inference_mode), torch.set_grad_enabled(grad_enabled):
+        return fn()
 
 
 class FlowStep(nn.Module):
@@ -72,11 +104,17 @@ class FlowStep(nn.Module):
         )
 
     def enable_inverse_cache(self):
-        self.invtbl_conv.cache_inverse = True
+        self.invtbl_conv.enable_inverse_cache()
+
+    @property
+    def receptive_field(self):
+        return self.affine_tfn.affine_param_predictor.receptive_field
 
-    def forward(self, z, context, inverse=False, seq_lens=None):
+    def forward(self, z, context, inverse=False, seq_lens=None, context_proj=None):
         if inverse:  # for inference z-> mel
-            z = self.affine_tfn(z, context, inverse, seq_lens=seq_lens)
+            z = self.affine_tfn(
+                z, context, inverse, seq_lens=seq_lens, context_proj=context_proj
+            )
             z = self.invtbl_conv(z, inverse)
             return z
         else:  # training mel->z
@@ -257,6 +295,10 @@ class RADTTS(torch.nn.Module):
             dur_model_config["hparams"]["n_speaker_dim"] = n_speaker_dim
             self.dur_pred_layer = get_attribute_prediction_model(dur_model_config)
 
+        # run the energy predictor in a worker thread at inference on CPU, see
+        # `infer_f0_and_energy`
+        self.concurrent_attributes = False
+
         self.use_unvoiced_bias = False
         self.use_vpred_module = False
         self.ap_use_voiced_embeddings = kwargs.get("ap_use_voiced_embeddings", True)
@@ -341,6 +383,19 @@ class RADTTS(torch.nn.Module):
         spk_vecs = self.speaker_embedding(spk_ids)
         return spk_vecs
 
+    def encode_speaker_batch(self, spk_ids, batch_size, n_samples=1):
+        """Encodes one speaker per item, a single speaker is shared by all items.
+
+        With `n_samples` consecutive items per text, a speaker per text is
+        shared by the items of that text.
+        """
+        spk_vecs = self.encode_speaker(spk_ids)
+        if spk_vecs.shape[0] == 1 and batch_size > 1:
+            spk_vecs = spk_vecs.expand(batch_size, -1)
+        elif n_samples > 1 and spk_vecs.shape[0] * n_samples == batch_size:
+            spk_vecs = spk_vecs.repeat_interleave(n_samples, 0)
+        return spk_vecs
+
     def encode_text(self, text, in_lens):
         # text_embeddings: b x len_text x n_text_dim
         text_embeddings = self.embedding(text).transpose(1, 2)
@@ -400,6 +455,80 @@ class RADTTS(torch.nn.Module):
         for flow_step in self.flows:
             flow_step.enable_inverse_cache()
 
+    def get_flow_chunk_size(self, memory_budget, batch_size=1):
+        """Largest number of folded frames per inverse flow window whose
+        activations fit in `memory_budget` bytes, see `infer_flow_step`.
+        """
+        flow_step = self.flows[0]
+        n_channels = max(
+            m.out_channels
+            for m in flow_step.affine_tfn.modules()
+            if isinstance(m, nn.Conv1d)
+        )
+        element_size = next(self.parameters()).element_size()
+        # WN keeps about this many n_channels-wide activations alive at once
+        n_live_activations = 6
+        bytes_per_frame = batch_size * n_live_activations * n_channels * element_size
+        chunk_size = memory_budget // bytes_per_frame - 2 * flow_step.receptive_field
+        if chunk_size < 1:
+            raise ValueError(
+                "Memory budget of {} bytes is too small for the flow decoder".format(
+                    memory_budget
+                )
+            )
+        return int(chunk_size)
+
+    def project_flow_contexts(self, context):
+        """Applies the context columns of the input projection (`WN.start`)
+        of every flow step to the context in one matmul, see `WN.forward`.
+
+        Returns:
+            list of B x n_channels x T projections, one per flow step, or
+            None if the flow steps do not use WN
+        """
+        wns = [flow_step.affine_tfn.affine_param_predictor for flow_step in self.flows]
+        if not all(isinstance(wn, WN) for wn in wns):
+            return None
+        weight = torch.cat([wn.start.weight[:, wn.n_in_channels :] for wn in wns])
+        bias = torch.cat([wn.start.bias for wn in wns])
+        projections = nn.functional.conv1d(context, weight, bias)
+        return projections.split([wn.n_channels for wn in wns], 1)
+
+    def infer_flow_step(
+        self, flow_step, z, context, masks, chunk_size=None, context_proj=None
+    ):
+        """Inverts a single flow step, optionally in windows of `chunk_size`
+        folded frames to bound the activation memory on long inputs. `masks`
+        is the MaskContext of the folded frames, shared by all the steps, and
+        `context_proj` the step's output of `project_flow_contexts`.
+
+        Every window is extended by the receptive field of the step on both
+        sides and only its center is kept, so the stitched output matches
+        the full-sequence inversion.
+        """
+        n_frames = z.shape[2]
+        if chunk_size is None or n_frames <= chunk_size:
+            return flow_step(
+                z, context, inverse=True, seq_lens=masks, context_proj=context_proj
+            )
+
+        n_context = flow_step.receptive_field
+        out = torch.empty_like(z)
+        for start in range(0, n_frames, chunk_size):
+            end = min(start + chunk_size, n_frames)
+            window_start = max(start - n_context, 0)
+            window_end = min(end + n_context, n_frames)
+            window = flow_step(
+                z[:, :, window_start:window_end],
+                context[:, :, window_start:window_end],
+                inverse=True,
+                seq_lens=masks.window(window_start, window_end),
+            )
+            out[:, :, start:end] = window[
+                :, :, start - window_start : end - window_start
+            ]
+        return out
+
     def fold(self, mel):
         """Inverse of the self.unfold(mel.unsqueeze(-1)) operation used for the
         grouping or "squeeze" operation on input
@@ -418,6 +547,9 @@ class RADTTS(torch.nn.Module):
         Args:
             attn: B x 1 x max_mel_len x max_text_len
         """
+        # numba is slow to import and only needed for training
+        from .alignment import mas_width1 as mas
+
         b_size = attn.shape[0]
         with torch.no_grad():
             attn_cpu = attn.data.cpu().numpy()
@@ -682,55 +814,123 @@ class RADTTS(torch.nn.Module):
         f0_std=0.0,
         energy_mean=0.0,
         energy_std=0.0,
+        in_lens=None,
+        n_samples=1,
+        flow_chunk_size=None,
+        flow_memory_budget=None,
+        prosody_only=False,
+        generator=None,
+        timer=None,
     ):
-        batch_size = text.shape[0]
+        """Synthesizes mels for a batch of (zero-padded) token sequences.
+
+        `in_lens` holds the number of valid tokens of each item and may be
+        omitted for unpadded inputs. With `n_samples` > 1 every text is encoded
+        once and then expanded into `n_samples` consecutive items, e.g. to draw
+        several takes, or to render it in several voices, in one pass. The
+        speaker ids are one for all items, one per text or one per output item.
+        The sigmas, `token_dur_scaling`, `f0_mean` and `f0_std` are either
+        scalars or one value per output item. Items are padded to the longest
+        one; `out_lens` in the outputs holds the number of valid frames of each
+        item.
+
+        The flow decoder runs over the whole sequence at once unless
+        `flow_chunk_size` (in folded frames) or `flow_memory_budget` (in
+        bytes) is given, in which case it is inverted window by window.
+
+        The predictors are skipped for the given `dur`, `f0`, `energy_avg` and
+        `voiced_mask`; `f0` is still renormalized if `f0_mean` is set. With
+        `prosody_only`, the decoder is skipped and only these four and
+        `out_lens` are returned.
+
+        All noise is drawn from `generator` if given, so a generator seeded
+        the same way reproduces the same outputs. Skipped predictors draw
+        their noise as well, so passing in the prosody of a seeded call
+        reproduces its mels. A `StageTimer` passed as `timer` collects the
+        time spent in each stage.
+        """
+        n_texts = text.shape[0]
         n_tokens = text.shape[1]
-        spk_vec = self.encode_speaker(speaker_id)
+        batch_size = n_texts * n_samples
+        sigma = get_per_item_values(sigma, batch_size, text.device)
+        sigma_dur = get_per_item_values(sigma_dur, batch_size, text.device)
+        sigma_f0 = get_per_item_values(sigma_f0, batch_size, text.device)
+        sigma_energy = get_per_item_values(sigma_energy, batch_size, text.device)
+        token_dur_scaling = get_per_item_values(
+            token_dur_scaling, batch_size, text.device
+        )
+
+        spk_vec = self.encode_speaker_batch(speaker_id, batch_size, n_samples)
         spk_vec_text, spk_vec_attributes = spk_vec, spk_vec
         if speaker_id_text is not None:
-            spk_vec_text = self.encode_speaker(speaker_id_text)
+            spk_vec_text = self.encode_speaker_batch(
+                speaker_id_text, batch_size, n_samples
+            )
         if speaker_id_attributes is not None:
-            spk_vec_attributes = self.encode_speaker(speaker_id_attributes)
+            spk_vec_attributes = self.encode_speaker_batch(
+                speaker_id_attributes, batch_size, n_samples
+            )
+
+        # the unpadded single-item path keeps the original per-call behaviour
+        if batch_size > 1 and in_lens is None:
+            in_lens = torch.full(
+                (n_texts,), n_tokens, dtype=torch.long, device=text.device
+            )
+        with time_stage(timer, "text_encoder"):
+            txt_enc, txt_emb = self.encode_text(text, in_lens if n_texts > 1 else None)
 
-        txt_enc, txt_emb = self.encode_text(text, None)
+        if n_samples > 1:
+            txt_enc = txt_enc.repeat_interleave(n_samples, 0)
+            in_lens = in_lens.repeat_interleave(n_samples, 0)
 
         if dur is None:
             # get token durations
-            z_dur = (
-                torch.randn(batch_size, 1, n_tokens, dtype=torch.float32, device=device)
-                * sigma_dur
+            with time_stage(timer, "duration"):
+                dur = self.predict_durations(
+                    txt_enc,
+                    spk_vec_text,
+                    in_lens,
+                    sigma_dur,
+                    token_dur_scaling,
+                    token_duration_max,
+                    generator,
+                )
+        else:
+            # skipped predictors still draw their noise, see the docstring
+            torch.randn(
+                batch_size,
+                1,
+                n_tokens,
+                dtype=torch.float32,
+                device=text.device,
+                generator=generator,
             )
 
-            dur = self.dur_pred_layer.infer(z_dur, txt_enc, spk_vec_text)
-            if dur.shape[-1] < txt_enc.shape[-1]:
-                to_pad = txt_enc.shape[-1] - dur.shape[2]
-                pad_fn = nn.ReplicationPad1d((0, to_pad))
-                dur = pad_fn(dur)
-            dur = dur[:, 0]
-            dur = dur.clamp(0, token_duration_max)
-            dur = dur * token_dur_scaling if token_dur_scaling > 0 else dur
-            dur = (dur + 0.5).floor().int()
-
-        out_lens = dur.sum(1).long().cpu() if dur.shape[0] != 1 else [dur.sum(1)]
-        max_n_frames = max(out_lens)
-
-        out_lens = torch.LongTensor(out_lens).to(txt_enc.device)
+        out_lens = dur.sum(1).long()
+        max_n_frames = int(out_lens.max())
 
         # get attributes f0, energy, vpred, etc)
-        txt_enc_time_expanded = self.length_regulator(
-            txt_enc.transpose(1, 2), dur
-        ).transpose(1, 2)
+        with time_stage(timer, "length_regulator"):
+            txt_enc_time_expanded = self.length_regulator(
+                txt_enc.transpose(1, 2), dur
+            ).transpose(1, 2)
+
+        # lengths are only needed to keep padded frames out of the predictors
+        ap_lens = out_lens if batch_size > 1 else None
 
         if not self.is_attribute_unconditional():
             # if explicitly modeling attributes
             if voiced_mask is None:
                 if self.use_vpred_module:
                     # get logits
-                    voiced_mask = self.v_pred_module.infer(
-                        None, txt_enc_time_expanded, spk_vec_attributes
-                    )
-                    voiced_mask = torch.sigmoid(voiced_mask[:, 0]) > 0.5
-                    voiced_mask = voiced_mask.float()
+                    with time_stage(timer, "voiced"):
+                        voiced_mask = self.v_pred_module.infer(
+                            None, txt_enc_time_expanded, spk_vec_attributes, ap_lens
+                        )
+                        voiced_mask = torch.sigmoid(voiced_mask[:, 0]) > 0.5
+                        voiced_mask = voiced_mask.float()
+                        if batch_size > 1:
+                            voiced_mask = voiced_mask * get_mask_from_lengths(out_lens)
 
             ap_txt_enc_time_expanded = txt_enc_time_expanded
             # voice mask augmentation only used for attribute prediction
@@ -739,74 +939,108 @@ class RADTTS(torch.nn.Module):
                     txt_enc_time_expanded, voiced_mask
                 )
 
-            f0_bias = 0
-            # unvoiced bias forward pass
-            if self.use_unvoiced_bias:
-                f0_bias = self.unvoiced_bias_module(
-                    txt_enc_time_expanded.permute(0, 2, 1)
-                )
-                f0_bias = -f0_bias[..., 0]
-                f0_bias = f0_bias * (~voiced_mask.bool()).float()
-
-            if f0 is None:
+            with time_stage(timer, "f0_energy"):
                 n_f0_feature_channels = 2 if self.use_first_order_features else 1
 
-                z_f0 = (
-                    torch.randn(
-                        batch_size,
-                        n_f0_feature_channels,
-                        max_n_frames,
-                        dtype=torch.float32,
-                    )
-                    * sigma_f0
-                ).to(device)
-
-                f0 = self.infer_f0(
-                    z_f0,
-                    ap_txt_enc_time_expanded,
-                    spk_vec_attributes,
-                    voiced_mask,
-                    out_lens,
-                )[:, 0]
-
-            if f0_mean > 0.0:
-                vmask_bool = voiced_mask.bool()
-                f0_mu, f0_sigma = f0[vmask_bool].mean(), f0[vmask_bool].std()
-                f0[vmask_bool] = (f0[vmask_bool] - f0_mu) / f0_sigma
-                f0_std = f0_std if f0_std > 0 else f0_sigma
-                f0[vmask_bool] = f0[vmask_bool] * f0_std + f0_mean
+                z_f0 = torch.randn(
+                    batch_size,
+                    n_f0_feature_channels,
+                    max_n_frames,
+                    dtype=torch.float32,
+                    device=text.device,
+                    generator=generator,
+                )
+                z_f0 = z_f0 * sigma_f0[:, None, None]
 
-            if energy_avg is None:
                 n_energy_feature_channels = 2 if self.use_first_order_features else 1
 
-                z_energy_avg = (
-                    torch.randn(
-                        batch_size,
-                        n_energy_feature_channels,
-                        max_n_frames,
-                        dtype=torch.float32,
-                        device=device,
+                z_energy_avg = torch.randn(
+                    batch_size,
+                    n_energy_feature_channels,
+                    max_n_frames,
+                    dtype=torch.float32,
+                    device=text.device,
+                    generator=generator,
+                )
+                z_energy_avg = z_energy_avg * sigma_energy[:, None, None]
+
+                if f0 is None and energy_avg is None:
+                    f0, energy_avg = self.infer_f0_and_energy(
+                        z_f0,
+                        z_energy_avg,
+                        ap_txt_enc_time_expanded,
+                        spk_vec_attributes,
+                        spk_vec,
+                        voiced_mask,
+                        out_lens,
+                    )
+                    f0, energy_avg = f0[:, 0], energy_avg[:, 0]
+                elif f0 is None:
+                    f0 = self.infer_f0(
+                        z_f0,
+                        ap_txt_enc_time_expanded,
+                        spk_vec_attributes,
+                        voiced_mask,
+                        out_lens,
+                    )[:, 0]
+                elif energy_avg is None:
+                    energy_avg = self.infer_energy(
+                        z_energy_avg, ap_txt_enc_time_expanded, spk_vec, out_lens
+                    )[:, 0]
+
+            with time_stage(timer, "f0_renorm"):
+                f0_bias = 0
+                # unvoiced bias forward pass
+                if self.use_unvoiced_bias:
+                    f0_bias = self.unvoiced_bias_module(
+                        txt_enc_time_expanded.permute(0, 2, 1)
                     )
-                    * sigma_energy
+                    f0_bias = -f0_bias[..., 0]
+                    f0_bias = f0_bias * (~voiced_mask.bool()).float()
+
+                # renormalize each item over its own voiced frames
+                f0_mean = get_per_item_values(f0_mean, batch_size, text.device).tolist()
+                f0_std = get_per_item_values(f0_std, batch_size, text.device).tolist()
+                for i in range(batch_size):
+                    if f0_mean[i] > 0.0:
+                        f0_i = f0[i, : out_lens[i]]
+                        vmask_bool = voiced_mask[i, : f0_i.shape[0]].bool()
+                        f0_mu, f0_sigma = (
+                            f0_i[vmask_bool].mean(),
+                            f0_i[vmask_bool].std(),
+                        )
+                        f0_i[vmask_bool] = (f0_i[vmask_bool] - f0_mu) / f0_sigma
+                        f0_std_i = f0_std[i] if f0_std[i] > 0 else f0_sigma
+                        f0_i[vmask_bool] = f0_i[vmask_bool] * f0_std_i + f0_mean[i]
+
+            with time_stage(timer, "attribute_padding"):
+                # replication pad, because ungrouping with different group sizes
+                # may lead to mismatched lengths
+                if energy_avg.shape[1] < max_n_frames:
+                    to_pad = max_n_frames - energy_avg.shape[1]
+                    pad_fn = nn.ReplicationPad1d((0, to_pad))
+                    f0 = pad_fn(f0[None])[0]
+                    energy_avg = pad_fn(energy_avg[None])[0]
+                if f0.shape[1] < max_n_frames:
+                    to_pad = max_n_frames - f0.shape[1]
+                    pad_fn = nn.ReplicationPad1d((0, to_pad))
+                    f0 = pad_fn(f0[None])[0]
+
+        if prosody_only:
+            return {
+                "dur": dur,
+                "f0": f0,
+                "energy_avg": energy_avg,
+                "voiced_mask": voiced_mask,
+                "out_lens": out_lens,
+            }
+
+        with time_stage(timer, "context_lstm"):
+            if self.is_attribute_unconditional():
+                context_w_spkvec = self.preprocess_context(
+                    txt_enc_time_expanded, spk_vec, out_lens, None, None
                 )
-
-                energy_avg = self.infer_energy(
-                    z_energy_avg, ap_txt_enc_time_expanded, spk_vec, out_lens
-                )[:, 0]
-
-            # replication pad, because ungrouping with different group sizes
-            # may lead to mismatched lengths
-            if energy_avg.shape[1] < out_lens[0]:
-                to_pad = out_lens[0] - energy_avg.shape[1]
-                pad_fn = nn.ReplicationPad1d((0, to_pad))
-                f0 = pad_fn(f0[None])[0]
-                energy_avg = pad_fn(energy_avg[None])[0]
-            if f0.shape[1] < out_lens[0]:
-                to_pad = out_lens[0] - f0.shape[1]
-                pad_fn = nn.ReplicationPad1d((0, to_pad))
-                f0 = pad_fn(f0[None])[0]
-
-            if self.decoder_use_unvoiced_bias:
+            elif self.decoder_use_unvoiced_bias:
                 context_w_spkvec = self.preprocess_context(
                     txt_enc_time_expanded,
                     spk_vec,
@@ -822,30 +1056,44 @@ class RADTTS(torch.nn.Module):
                     f0 * voiced_mask,
                     energy_avg,
                 )
-        else:
-            context_w_spkvec = self.preprocess_context(
-                txt_enc_time_expanded, spk_vec, out_lens, None, None
-            )
 
         residual = torch.randn(
             batch_size,
             80 * self.n_group_size,
             max_n_frames // self.n_group_size,
             dtype=torch.float32,
-        ).to(device)
+            device=text.device,
+            generator=generator,
+        )
 
-        residual = residual * sigma
+        residual = residual * sigma[:, None, None]
 
         # map from z sample to data
         exit_steps_stack = self.exit_steps.copy()
         mel = residual[:, len(exit_steps_stack) * self.n_early_size :]
         remaining_residual = residual[:, : len(exit_steps_stack) * self.n_early_size]
-        unfolded_seq_lens = out_lens // self.n_group_size
+        # built once: the masks and mask ratios are the same for every step
+        masks = MaskContext(out_lens // self.n_group_size, mel.shape[2])
+        if flow_chunk_size is None and flow_memory_budget is not None:
+            flow_chunk_size = self.get_flow_chunk_size(flow_memory_budget, batch_size)
+        # the context is the same for every step, so its share of their input
+        # projections is computed at once; not when decoding in windows, as
+        # that would hold the projections of all steps for the whole sequence
+        context_projs = None
+        if flow_chunk_size is None:
+            with time_stage(timer, "flow_context"):
+                context_projs = self.project_flow_contexts(context_w_spkvec)
         for i, flow_step in enumerate(reversed(self.flows)):
             curr_step = len(self.flows) - i - 1
-            mel = flow_step(
-                mel, context_w_spkvec, inverse=True, seq_lens=unfolded_seq_lens
-            )
+            with time_stage(timer, "flow_{}".format(curr_step)):
+                mel = self.infer_flow_step(
+                    flow_step,
+                    mel,
+                    context_w_spkvec,
+                    masks,
+                    flow_chunk_size,
+                    context_projs[curr_step] if context_projs is not None else None,
+                )
             if len(exit_steps_stack) > 0 and curr_step == exit_steps_stack[-1]:
                 # concatenate the next chunk of z
                 exit_steps_stack.pop()
@@ -868,13 +1116,191 @@ class RADTTS(torch.nn.Module):
             "f0": f0,
             "energy_avg": energy_avg,
             "voiced_mask": voiced_mask,
+            "out_lens": out_lens,
+        }
+
+    def predict_durations(
+        self,
+        txt_enc,
+        spk_vec_text,
+        in_lens,
+        sigma_dur,
+        token_dur_scaling,
+        token_duration_max=100,
+        generator=None,
+    ):
+        """Predicts the frames of every token from the encoded text.
+
+        `sigma_dur` and `token_dur_scaling` hold one value per item. Returns
+        B x N integer durations, zero for padded tokens.
+        """
+        batch_size, _, n_tokens = txt_enc.shape
+        z_dur = torch.randn(
+            batch_size,
+            1,
+            n_tokens,
+            dtype=torch.float32,
+            device=txt_enc.device,
+            generator=generator,
+        )
+        z_dur = z_dur * sigma_dur[:, None, None]
+
+        dur = self.dur_pred_layer.infer(
+            z_dur, txt_enc, spk_vec_text, in_lens if batch_size > 1 else None
+        )
+        if dur.shape[-1] < txt_enc.shape[-1]:
+            to_pad = txt_enc.shape[-1] - dur.shape[2]
+            pad_fn = nn.ReplicationPad1d((0, to_pad))
+            dur = pad_fn(dur)
+        dur = dur[:, 0]
+        dur = dur.clamp(0, token_duration_max)
+        dur = torch.where(
+            token_dur_scaling[:, None] > 0,
+            dur * token_dur_scaling[:, None],
+            dur,
+        )
+        dur = (dur + 0.5).floor().int()
+        if in_lens is not None:
+            # padded tokens must not produce frames
+            dur = dur * get_mask_from_lengths(in_lens, n_tokens)
+        return dur
+
+    def infer_durations(
+        self,
+        speaker_id,
+        text,
+        sigma_dur=0.8,
+        token_dur_scaling=1.0,
+        token_duration_max=100,
+        in_lens=None,
+        generator=None,
+        timer=None,
+    ):
+        """Runs only the text encoder and the duration predictor of `infer`.
+
+        Given the same `generator` state and arguments, the durations are the
+        ones `infer` uses, as they are drawn first. `speaker_id` is the text
+        speaker (`speaker_id_text` of `infer`).
+
+        Returns:
+            B x N integer token durations and the B numbers of output frames
+        """
+        n_texts, n_tokens = text.shape
+        sigma_dur = get_per_item_values(sigma_dur, n_texts, text.device)
+        token_dur_scaling = get_per_item_values(token_dur_scaling, n_texts, text.device)
+        spk_vec_text = self.encode_speaker_batch(speaker_id, n_texts)
+
+        if n_texts > 1 and in_lens is None:
+            in_lens = torch.full(
+                (n_texts,), n_tokens, dtype=torch.long, device=text.device
+            )
+        with time_stage(timer, "text_encoder"):
+            txt_enc, _ = self.encode_text(text, in_lens if n_texts > 1 else None)
+        with time_stage(timer, "duration"):
+            dur = self.predict_durations(
+                txt_enc,
+                spk_vec_text,
+                in_lens,
+                sigma_dur,
+                token_dur_scaling,
+                token_duration_max,
+                generator,
+            )
+        return dur, dur.sum(1).long()
+
+    def stage_macs(self):
+        """Multiply-accumulates of every stage of `infer` per input token and
+        per output frame, as a `{stage: (per_token, per_frame)}` dictionary.
+
+        Counts the convs, linear layers and LSTMs, which do nearly all of the
+        work; the flows and the context LSTM run once every `n_group_size`
+        frames.
+        """
+        per_token = {
+            "text_encoder": self.encoder,
+            "duration": self.dur_pred_layer,
         }
+        per_frame = {}
+        if not self.is_attribute_unconditional():
+            if self.use_vpred_module:
+                per_frame["voiced"] = self.v_pred_module
+            per_frame["f0_energy"] = [self.f0_pred_module, self.energy_pred_module]
+            if self.use_unvoiced_bias:
+                per_frame["f0_renorm"] = self.unvoiced_bias_module
+        per_group = {"flow": self.flows}
+        if self.use_context_lstm:
+            per_group["context_lstm"] = self.context_lstm
+
+        macs = {}
+        for stage, modules in per_token.items():
+            macs[stage] = (count_macs(modules), 0)
+        for stage, modules in per_frame.items():
+            macs[stage] = (0, count_macs(modules))
+        for stage, modules in per_group.items():
+            macs[stage] = (0, count_macs(modules) // self.n_group_size)
+        return macs
+
+    def infer_f0_and_energy(
+        self,
+        residual_f0,
+        residual_energy,
+        txt_enc_time_expanded,
+        spk_vec_f0,
+        spk_vec_energy,
+        voiced_mask=None,
+        lens=None,
+    ):
+        """Same as `infer_f0` and `infer_energy`, which read the same input.
+
+        With DAP predictors, their bottleneck layers run as one conv. With
+        `concurrent_attributes` set, on a CPU, the energy predictor also runs
+        in a worker thread next to the F0 one. Both then use the whole
+        intra-op thread pool, so this only pays off with cores to spare
+        (e.g. with `torch.set_num_threads` at half of them); it is off by
+        default.
+        """
+        f0_module, energy_module = self.f0_pred_module, self.energy_pred_module
+        if not (isinstance(f0_module, DAP) and isinstance(energy_module, DAP)):
+            f0 = self.infer_f0(
+                residual_f0, txt_enc_time_expanded, spk_vec_f0, voiced_mask, lens
+            )
+            energy = self.infer_energy(
+                residual_energy, txt_enc_time_expanded, spk_vec_energy, lens
+            )
+            return f0, energy
+
+        f0_enc, energy_enc = infer_bottlenecks(
+            [f0_module.bottleneck_layer, energy_module.bottleneck_layer],
+            txt_enc_time_expanded,
+        )
+
+        def infer_energy():
+            return energy_module.infer_bottlenecked(energy_enc, spk_vec_energy, lens)
+
+        energy_future = None
+        if self.concurrent_attributes and txt_enc_time_expanded.device.type == "cpu":
+            energy_future = attribute_executor.submit(
+                run_in_grad_mode,
+                infer_energy,
+                torch.is_inference_mode_enabled(),
+                torch.is_grad_enabled(),
+            )
+
+        f0 = f0_module.infer_bottlenecked(f0_enc, spk_vec_f0, lens)
+        if energy_future is not None:
+            energy = energy_future.result()
+        else:
+            energy = infer_energy()
+
+        return self.postprocess_f0(f0, voiced_mask), self.postprocess_energy(energy)
 
     def infer_f0(
         self, residual, txt_enc_time_expanded, spk_vec, voiced_mask=None, lens=None
     ):
         f0 = self.f0_pred_module.infer(residual, txt_enc_time_expanded, spk_vec, lens)
+        return self.postprocess_f0(f0, voiced_mask)
 
+    def postprocess_f0(self, f0, voiced_mask=None):
         if voiced_mask is not None and len(voiced_mask.shape) == 2:
             voiced_mask = voiced_mask[:, None]
 
@@ -907,7 +1333,9 @@ class RADTTS(torch.nn.Module):
         energy = self.energy_pred_module.infer(
             residual, txt_enc_time_expanded, spk_vec, lens
         )
+        return self.postprocess_energy(energy)
 
+    def postprocess_energy(self, energy):
         # magic constants
         if self.use_first_order_features:
             energy = energy / 3
@@ -918,21 +1346,17 @@ class RADTTS(torch.nn.Module):
 
     def remove_norms(self):
         """Removes spectral and weightnorms from model. Call before inference"""
-        for name, module in self.named_modules():
-            try:
-                nn.utils.remove_spectral_norm(module, name="weight_hh_l0")
-                print("Removed spectral norm from {}".format(name))
-            except Exception as e:
-                print(e)
-
-            try:
-                nn.utils.remove_spectral_norm(module, name="weight_hh_l0_reverse")
-                print("Removed spectral norm from {}".format(name))
-            except Exception as e:
-                print(e)
-
-            try:
-                nn.utils.remove_weight_norm(module)
-                print("Removed wnorm from {}".format(name))
-            except Exception as e:
-                print(e)
+        for name in remove_parametrizations(self):
+            print("Removed norm from {}".format(name))
+
+    def freeze_for_inference(self):
+        """Switches to eval mode, bakes the weight and spectral norms into
+        plain weights, precomputes the inverse 1x1 conv weights of the flows
+        and disables gradients, so that inference does not recompute any of
+        them on every forward. The model can not be trained afterwards.
+        """
+        self.eval()
+        remove_parametrizations(self)
+        self.enable_inverse_cache()
+        self.requires_grad_(False)
+        return self
@@ -54,6 +54,21 @@ class ISTFTHead(FourierHead):
         Returns:
             Tensor: Reconstructed time-domain audio signal of shape (B, T), where T is the length of the output signal.
         """
+        S = self.spectrogram(x)
+        audio = self.istft(S)
+        return audio
+
+    def spectrogram(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        Predicts the complex STFT coefficients that the ISTFT turns into audio.
+
+        Args:
+            x (Tensor): Input tensor of shape (B, L, H), where B is the batch size,
+                        L is the sequence length, and H denotes the model dimension.
+
+        Returns:
+            Tensor: Complex spectrogram of shape (B, N, L), where N is the number of frequency bins.
+        """
         x = self.out(x).transpose(1, 2)
         mag, p = x.chunk(2, dim=1)
         mag = torch.exp(mag)
@@ -69,8 +84,7 @@ class ISTFTHead(FourierHead):
         # S = mag * torch.exp(phase * 1j)
         # better directly produce the complex value
         S = mag * (x + 1j * y)
-        audio = self.istft(S)
-        return audio
+        return S
 
 
 class IMDCTSymExpHead(FourierHead):
@@ -69,6 +69,13 @@ class VocosBackbone(Backbone):
         self.final_layer_norm = nn.LayerNorm(dim, eps=1e-6)
         self.apply(self._init_weights)
 
+    @property
+    def receptive_field(self) -> int:
+        """Number of neighbouring frames on each side that an output frame depends on."""
+        return self.embed.padding[0] + sum(
+            block.dwconv.padding[0] for block in self.convnext
+        )
+
     def _init_weights(self, m):
         if isinstance(m, (nn.Conv1d, nn.Linear)):
             nn.init.trunc_normal_(m.weight, std=0.02)
@@ -1,16 +1,24 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Optional, Tuple, Union
+import itertools
+import math
+from contextlib import nullcontext
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 import torch
 import yaml
 from huggingface_hub import hf_hub_download
 from torch import nn
+from torch.nn.utils import parametrize, remove_weight_norm
+from torch.nn.utils.weight_norm import WeightNorm
 
 from vocos.feature_extractors import FeatureExtractor
-from vocos.heads import FourierHead
+from vocos.heads import FourierHead, ISTFTHead
 from vocos.models import Backbone
 
+# Log-mel value of digital silence, matching the clipping in `safe_log`
+SILENCE_LOG_MEL = math.log(1e-5)
+
 
 def instantiate_class(args: Union[Any, Tuple[Any, ...]], init: Dict[str, Any]) -> Any:
     """Instantiates a class with the given args and init.
@@ -80,6 +88,28 @@ class Vocos(nn.Module):
         model.eval()
         return model
 
+    def freeze_for_inference(self) -> Vocos:
+        """
+        Switches to eval mode, folds weight normalization (both the hook-based and the parametrization-based one)
+        into plain weights and disables gradients. The model can not be trained afterwards.
+
+        Returns:
+            Vocos: The frozen model itself.
+        """
+        self.eval()
+        # not under no_grad, which would turn the baked weights into buffers
+        for module in self.modules():
+            for hook in list(module._forward_pre_hooks.values()):
+                if isinstance(hook, WeightNorm):
+                    remove_weight_norm(module, hook.name)
+            if parametrize.is_parametrized(module):
+                for name in list(module.parametrizations.keys()):
+                    parametrize.remove_parametrizations(
+                        module, name, leave_parametrized=True
+                    )
+        self.requires_grad_(False)
+        return self
+
     @torch.inference_mode()
     def forward(self, audio_input: torch.Tensor, **kwargs: Any) -> torch.Tensor:
         """
@@ -99,7 +129,9 @@ class Vocos(nn.Module):
         return audio_output
 
     @torch.inference_mode()
-    def decode(self, features_input: torch.Tensor, **kwargs: Any) -> torch.Tensor:
+    def decode(
+        self, features_input: torch.Tensor, timer: Optional[Any] = None, **kwargs: Any
+    ) -> torch.Tensor:
         """
         Method to decode audio waveform from already calculated features. The features input is passed through
         the backbone and the head to reconstruct the audio output.
@@ -107,10 +139,165 @@ class Vocos(nn.Module):
         Args:
             features_input (Tensor): The input tensor of features of shape (B, C, L), where B is the batch size,
                                      C denotes the feature dimension, and L is the sequence length.
+            timer (optional): Object whose `stage(name)` context manager times the "vocoder_backbone" and
+                              "vocoder_head" stages.
 
         Returns:
             Tensor: The output tensor representing the reconstructed audio waveform of shape (B, T).
         """
-        x = self.backbone(features_input, **kwargs)
-        audio_output = self.head(x)
+        with nullcontext() if timer is None else timer.stage("vocoder_backbone"):
+            x = self.backbone(features_input, **kwargs)
+        with nullcontext() if timer is None else timer.stage("vocoder_head"):
+            audio_output = self.head(x)
         return audio_output
+
+    @torch.inference_mode()
+    def decode_batch(
+        self,
+        features_input: Union[torch.Tensor, Sequence[torch.Tensor]],
+        lengths: Optional[Sequence[int]] = None,
+        pad_value: float = SILENCE_LOG_MEL,
+        **kwargs: Any,
+    ) -> List[torch.Tensor]:
+        """
+        Method to decode a batch of features of different lengths with one backbone and head pass. Shorter items are
+        padded with a silence-level log-mel and the waveforms are trimmed back to `frames * hop_length` samples.
+
+        Args:
+            features_input (Tensor or list of Tensors): Padded features of shape (B, C, L), or a list of features of
+                                                        shape (C, L_i) or (1, C, L_i).
+            lengths (list of int, optional): Number of valid frames per item. Required to trim padded (B, C, L)
+                                             input, inferred from a list input.
+            pad_value (float, optional): Value used to pad the features. Defaults to the log-mel of silence.
+
+        Returns:
+            list of Tensors: Waveforms of shape (1, T_i), one per item.
+        """
+        if isinstance(features_input, torch.Tensor):
+            features = features_input
+            if lengths is None:
+                lengths = [features.shape[2]] * features.shape[0]
+        else:
+            items = [f[0] if f.dim() == 3 else f for f in features_input]
+            if lengths is None:
+                lengths = [f.shape[1] for f in items]
+            features = items[0].new_full(
+                (len(items), items[0].shape[0], max(f.shape[1] for f in items)),
+                pad_value,
+            )
+            for i, f in enumerate(items):
+                features[i, :, : f.shape[1]] = f
+
+        if isinstance(lengths, torch.Tensor):
+            lengths = lengths.tolist()
+
+        audio_output = self.decode(features, **kwargs)
+        # the heads produce a fixed number of samples per frame
+        hop_length = audio_output.shape[1] // features.shape[2]
+        return [
+            audio_output[i : i + 1, : n * hop_length] for i, n in enumerate(lengths)
+        ]
+
+    @torch.inference_mode()
+    def decode_stream(
+        self,
+        features_input: Union[torch.Tensor, Iterable[torch.Tensor]],
+        chunk_size: int = 32,
+        **kwargs: Any,
+    ) -> Iterator[torch.Tensor]:
+        """
+        Method to decode audio waveform window by window, while the features are still arriving. Every window of
+        `chunk_size` frames runs through the backbone with enough neighbouring frames to cover its receptive field,
+        and the ISTFT frames are overlap-added across windows, so the concatenated output matches `decode` up to
+        floating point error while memory stays bounded by the window size.
+
+        Args:
+            features_input (Tensor or iterable of Tensors): Features of shape (B, C, L), or a stream of feature
+                                                            chunks of shape (B, C, L_i) and any lengths.
+            chunk_size (int, optional): Number of frames synthesized per window. Defaults to 32.
+
+        Yields:
+            Tensor: The next samples of the waveform, of shape (B, T_i).
+        """
+        if not isinstance(self.head, ISTFTHead) or self.head.istft.padding != "same":
+            raise ValueError("Streaming requires an ISTFTHead with 'same' padding.")
+        if not hasattr(self.backbone, "receptive_field"):
+            raise ValueError(
+                "Streaming requires a backbone with a known receptive field."
+            )
+
+        istft = self.head.istft
+        hop_length = istft.hop_length
+        pad = (istft.win_length - hop_length) // 2
+        context = self.backbone.receptive_field
+
+        if isinstance(features_input, torch.Tensor):
+            features_input = features_input.split(chunk_size, dim=2)
+
+        # features received so far, starting at frame `features_start`
+        features, features_start = None, 0
+        # overlap-added samples and window envelope, starting at sample `ola_start`
+        ola, envelope, ola_start = None, None, 0
+        next_frame, emitted = 0, pad
+
+        for chunk in itertools.chain(features_input, [None]):
+            final = chunk is None
+            if not final:
+                features = (
+                    chunk if features is None else torch.cat((features, chunk), dim=2)
+                )
+            if features is None:
+                return
+            n_frames = features_start + features.shape[2]
+
+            while next_frame < n_frames and (
+                final or n_frames >= next_frame + chunk_size + context
+            ):
+                end = min(next_frame + chunk_size, n_frames)
+                start = max(next_frame - context, 0)
+                x = features[
+                    :,
+                    :,
+                    start - features_start : min(end + context, n_frames)
+                    - features_start,
+                ]
+                x = self.backbone(x, **kwargs)[:, next_frame - start : end - start]
+                frames = istft.frames(self.head.spectrogram(x))
+
+                # overlap-add the window at its position in the padded signal
+                audio = istft.overlap_add(frames)
+                window_sq = istft.window_envelope(end - next_frame)
+                offset = next_frame * hop_length - ola_start
+                size = offset + audio.shape[1]
+                if ola is None:
+                    ola = audio.new_zeros(audio.shape[0], size)
+                    envelope = window_sq.new_zeros(size)
+                elif ola.shape[1] < size:
+                    ola = torch.nn.functional.pad(ola, (0, size - ola.shape[1]))
+                    envelope = torch.nn.functional.pad(
+                        envelope, (0, size - envelope.shape[0])
+                    )
+                ola[:, offset:size] += audio
+                envelope[offset:size] += window_sq
+                next_frame = end
+
+                # frames before `next_frame - context` are no longer needed as context
+                drop = max(next_frame - context, 0) - features_start
+                if drop > 0:
+                    features = features[:, :, drop:]
+                    features_start += drop
+
+                # samples before the start of the next frame are complete
+                ready = next_frame * hop_length
+                if final and next_frame == n_frames:
+                    ready += pad
+                if ready > emitted:
+                    y = ola[:, emitted - ola_start : ready - ola_start]
+                    window_envelope = envelope[emitted - ola_start : ready - ola_start]
+                    assert (window_envelope > 1e-11).all()
+                    yield y / window_envelope
+                    emitted = ready
+
+                ola = ola[:, ready - ola_start :]
+                envelope = envelope[ready - ola_start :]
+                ola_start = ready
@@ -1,5 +1,4 @@
 import numpy as np
-import scipy
 import torch
 from torch import nn, view_as_complex, view_as_real
 
@@ -62,26 +61,13 @@ class ISTFT(nn.Module):
         B, N, T = spec.shape
 
         # Inverse FFT
-        ifft = torch.fft.irfft(spec, self.n_fft, dim=1, norm="backward")
-        ifft = ifft * self.window[None, :, None]
+        ifft = self.frames(spec)
 
         # Overlap and Add
-        output_size = (T - 1) * self.hop_length + self.win_length
-        y = torch.nn.functional.fold(
-            ifft,
-            output_size=(1, output_size),
-            kernel_size=(1, self.win_length),
-            stride=(1, self.hop_length),
-        )[:, 0, 0, pad:-pad]
+        y = self.overlap_add(ifft)[:, pad:-pad]
 
         # Window envelope
-        window_sq = self.window.square().expand(1, T, -1).transpose(1, 2)
-        window_envelope = torch.nn.functional.fold(
-            window_sq,
-            output_size=(1, output_size),
-            kernel_size=(1, self.win_length),
-            stride=(1, self.hop_length),
-        ).squeeze()[pad:-pad]
+        window_envelope = self.window_envelope(T)[pad:-pad]
 
         # Normalize
         assert (window_envelope > 1e-11).all()
@@ -89,6 +75,47 @@ class ISTFT(nn.Module):
 
         return y
 
+    def frames(self, spec: torch.Tensor) -> torch.Tensor:
+        """
+        Compute the windowed time-domain frames of a complex spectrogram, before overlap-add.
+
+        Args:
+            spec (Tensor): Input complex spectrogram of shape (B, N, T).
+
+        Returns:
+            Tensor: Windowed frames of shape (B, win_length, T).
+        """
+        ifft = torch.fft.irfft(spec, self.n_fft, dim=1, norm="backward")
+        return ifft * self.window[None, :, None]
+
+    def overlap_add(self, frames: torch.Tensor) -> torch.Tensor:
+        """
+        Overlap-add frames spaced by `hop_length` samples, without trimming any padding.
+
+        Args:
+            frames (Tensor): Frames of shape (B, win_length, T).
+
+        Returns:
+            Tensor: Signal of shape (B, (T - 1) * hop_length + win_length).
+        """
+        output_size = (frames.shape[2] - 1) * self.hop_length + self.win_length
+        return torch.nn.functional.fold(
+            frames,
+            output_size=(1, output_size),
+            kernel_size=(1, self.win_length),
+            stride=(1, self.hop_length),
+        )[:, 0, 0]
+
+    def window_envelope(self, n_frames: int) -> torch.Tensor:
+        """
+        Sum of the squared windows of `n_frames` overlapping frames, used to normalize the overlap-add output.
+
+        Returns:
+            Tensor: Envelope of shape ((n_frames - 1) * hop_length + win_length,).
+        """
+        window_sq = self.window.square().expand(1, n_frames, -1).transpose(1, 2)
+        return self.overlap_add(window_sq)[0]
+
 
 class MDCT(nn.Module):
     """
@@ -107,7 +134,9 @@ class MDCT(nn.Module):
         self.frame_len = frame_len
         N = frame_len // 2
         n0 = (N + 1) / 2
-        window = torch.from_numpy(scipy.signal.cosine(frame_len)).float()
+        from scipy.signal.windows import cosine
+
+        window = torch.from_numpy(cosine(frame_len)).float()
         self.register_buffer("window", window)
 
         pre_twiddle = torch.exp(-1j * torch.pi * torch.arange(frame_len) / frame_len)
@@ -168,7 +197,9 @@ class IMDCT(nn.Module):
         self.frame_len = frame_len
         N = frame_len // 2
         n0 = (N + 1) / 2
-        window = torch.from_numpy(scipy.signal.cosine(frame_len)).float()
+        from scipy.signal.windows import cosine
+
+        window = torch.from_numpy(cosine(frame_len)).float()
         self.register_buffer("window", window)
 
         pre_twiddle = torch.exp(1j * torch.pi * n0 * torch.arange(N * 2) / N)